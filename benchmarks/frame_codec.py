@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Microbenchmark of command frame encoding
+
+Compares the original per-call encoder (CRC7 table rebuilt on every call, header assembled from new bytes objects)
+with the precomputed frame codec. Run from the repository root:
+
+    python -m benchmarks.frame_codec
+"""
+
+import binascii
+import timeit
+
+from revvy.mcu.frame_codec import FrameWriter, encode_frame, CRC7_TABLE
+from revvy.mcu.rrrc_transport import Command
+
+
+def legacy_crc7(data, crc=0xFF):
+    crc7_table = list(CRC7_TABLE)  # the original implementation built this list on each call
+
+    for b in data:
+        crc = crc7_table[(b ^ (crc << 1) & 0xFF)]
+    return crc
+
+
+def legacy_get_bytes(op, command, payload):
+    payload = bytes(payload)
+    header = bytes([op, command, len(payload)])
+    payload_checksum = binascii.crc_hqx(payload, 0xFFFF)
+    header += bytes(payload_checksum.to_bytes(2, byteorder='little'))
+    header += bytes([legacy_crc7(header, 0xFF)])
+
+    return header + payload
+
+
+def run(number=100000):
+    writer = FrameWriter()
+    speed_payload = bytes([1, 0, 0, 0x80, 0x3f, 0, 0, 0x80, 0x3f, 0])
+
+    cases = {
+        'get_result (no payload)': (Command.OpGetResult, 0x3C, b''),
+        'ping (no payload)':       (Command.OpStart, 0x00, b''),
+        'drivetrain speed (10B)':  (Command.OpStart, 0x1B, speed_payload),
+    }
+
+    for name, (op, cmd, payload) in cases.items():
+        expected = legacy_get_bytes(op, cmd, payload)
+        assert expected == encode_frame(op, cmd, payload) == bytes(writer.write(op, cmd, payload))
+
+        before = timeit.timeit(lambda: legacy_get_bytes(op, cmd, payload), number=number)
+        after = timeit.timeit(lambda: writer.write(op, cmd, payload), number=number)
+
+        print('{:<25} before: {:>10.0f} frames/s  after: {:>10.0f} frames/s  ({:.1f}x)'.format(
+            name, number / before, number / after, before / after))
+
+
+if __name__ == "__main__":
+    run()
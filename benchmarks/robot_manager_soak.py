@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Soak test of RobotManager running against the software MCU emulator
+
+Starts the robot with the default configuration, drives it from a thread that issues drivetrain setpoints as fast
+as it can and prints the transport metrics at the end. Run from the repository root:
+
+    python -m benchmarks.robot_manager_soak [duration in seconds]
+"""
+
+import sys
+import tempfile
+import time
+from threading import Thread
+
+from revvy.mcu.emulator import RevvyTransportEmulator, FaultInjection
+from revvy.mcu.rrrc_control import RevvyControl
+from revvy.robot.telemetry_log import TelemetryLog, list_segments
+from revvy.utils import RobotManager
+
+
+class _Characteristic:
+    def update(self, value): pass
+    def update_value(self, value): pass
+
+
+class _Service:
+    def characteristic(self, name): return _Characteristic()
+    def register_message_handler(self, callback): pass
+    def update_motor(self, motor, power, speed, position): pass
+    def update_sensor(self, sensor, value): pass
+
+
+class OfflineBle:
+    """Stands in for RevvyBLE: accepts every update and never connects"""
+
+    def __getitem__(self, item): return _Service()
+    def on_connection_changed(self, callback): pass
+    def start(self): pass
+    def stop(self): pass
+
+
+def run(duration=10.0):
+    faults = FaultInjection(header_corruption=0.001, payload_corruption=0.001, command_integrity_error=0.001,
+                            busy=0.01, seed=0)
+    with RevvyTransportEmulator(transfer_time=0.0001, command_latency={0x12: 0.002, 0x22: 0.002},
+                                faults=faults) as transport:
+        robot_control = RevvyControl(transport.bind(0x2D))
+
+        telemetry_log = TelemetryLog(tempfile.mkdtemp())
+        manager = RobotManager(robot_control, OfflineBle(), {}, '0.0.0', telemetry_log=telemetry_log)
+        manager.needs_interrupting = False
+        manager.start()
+
+        # let the default configuration get applied
+        time.sleep(1)
+
+        # a drivetrain, so that the status rate sees moving motors
+        (left, right) = manager.robot.motors[1], manager.robot.motors[4]
+        left.configure('RevvyMotor_CCW')
+        right.configure('RevvyMotor')
+        manager.robot.drivetrain.add_left_motor(left)
+        manager.robot.drivetrain.add_right_motor(right)
+        manager.robot.drivetrain.configure()
+        robot_control.transport_metrics.reset()
+        status_rate = manager.robot.status_rate
+        status_rate.reset_metrics()
+
+        running = True
+        setpoints = 0
+
+        def drive():
+            nonlocal setpoints
+            while running:
+                speed = 100 * (setpoints % 10)
+                manager.robot.drivetrain.set_speeds(speed, -speed)
+                setpoints += 1
+                time.sleep(0.0005)
+
+        driver = Thread(target=drive)
+        driver.start()
+
+        time.sleep(duration)
+        running = False
+        driver.join()
+
+        metrics = robot_control.transport_metrics.snapshot()
+        slot_statistics = manager.robot.status_updater.slot_statistics()
+        driving_rate = status_rate.metrics()
+
+        # let the motors stop, then measure the idle rate
+        manager.robot.drivetrain.set_speeds(0, 0)
+        time.sleep(1)
+        status_rate.reset_metrics()
+        time.sleep(duration / 2)
+        idle_rate = status_rate.metrics()
+        manager.stop()
+
+    print('Setpoints issued: {}, sent: {}, dropped: {}, failed: {}'.format(
+        setpoints, robot_control.setpoints.sent, robot_control.setpoints.dropped, robot_control.setpoints.failed))
+    print('State writes saved: {}'.format(robot_control.state_cache.saved))
+    print('Telemetry records written: {}, dropped: {}, {} segment(s)'.format(
+        telemetry_log.written, telemetry_log.dropped, len(list_segments(telemetry_log.directory))))
+    for slot, statistics in slot_statistics.items():
+        print('status slot {}: {} reads, {:.0%} changed'.format(slot, statistics['reads'], statistics['change_rate']))
+    for phase, rate in (('driving', driving_rate), ('idle', idle_rate)):
+        print('status rate ({}): {:.1f}Hz, {:.0%} active, {:.0f} updates and {:.0f}ms saved vs. fixed rate'.format(
+            phase, rate['effective_rate'], rate['active_ratio'], rate['saved_updates'], 1000 * rate['saved_time']))
+    for name, value in metrics.items():
+        if name != 'commands':
+            print('{}: {}'.format(name, value))
+    for command, command_metrics in sorted(metrics['commands'].items()):
+        print('command {:02X}: {} calls, mean {:.2f}ms, p99 <= {:.1f}ms, {} errors'.format(
+            command, command_metrics['count'], 1000 * command_metrics['mean'], 1000 * command_metrics['p99'],
+            command_metrics['error_responses'] + command_metrics['failures']))
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0)
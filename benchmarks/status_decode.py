@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Decoding cost of a status update tick
+
+Configures every motor and sensor port of an emulated robot, captures one status response with all slots enabled,
+then times McuStatusUpdater.read() while the same response is served without any bus traffic. Slots whose data did
+not change are skipped, so two cases are timed: every slot invalidated before the read (decode), and the same
+response again (skip). The decode time includes invalidating the slots. Run from the repository root:
+
+    python -m benchmarks.status_decode
+"""
+
+import time
+
+from revvy.mcu.emulator import McuEmulator
+from revvy.mcu.rrrc_control import RevvyControl
+from revvy.mcu.rrrc_transport import RevvyTransport
+from revvy.utils import Robot
+
+
+def run(ticks=20000):
+    control = RevvyControl(RevvyTransport(McuEmulator()))
+    robot = Robot(control, {}, '0.0.0')
+    robot.reset()
+    for motor in robot.motors:
+        motor.configure('RevvyMotor')
+    for sensor in robot.sensors:
+        sensor.configure('HC_SR04' if sensor.id <= 2 else 'BumperSwitch')
+
+    payload = control.status_updater_read()
+
+    # only the decoding is measured from here on
+    control.status_updater_read = lambda: payload
+
+    updater = robot.status_updater
+    robot.update_status()
+    slots = list(updater.slot_statistics())
+
+    def decode():
+        for slot in slots:
+            updater.invalidate_slot(slot)
+        robot.update_status()
+
+    def measure(tick):
+        for _ in range(1000):
+            tick()
+
+        start = time.perf_counter()
+        for _ in range(ticks):
+            tick()
+        return 1e6 * (time.perf_counter() - start) / ticks
+
+    print('{} bytes of status, {} slots: decode {:.1f}us, skip {:.1f}us per tick'.format(
+        len(payload), len(slots), measure(decode), measure(robot.update_status)))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Benchmark of McuStatusUpdater.read on recorded bus traffic
+
+Replays a bus recording at maximum speed, so only the framework's own processing is measured. Without arguments a
+session is recorded on the MCU emulator first, a recording made on the robot can be given instead. The recording
+must start with the status updater configuration:
+
+    python -m benchmarks.status_replay [recording]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from revvy.mcu.bus_recorder import BusRecorder, RecordingTransport, ReplayTransport, read_recording
+from revvy.mcu.emulator import McuEmulator
+from revvy.mcu.rrrc_control import RevvyControl
+from revvy.mcu.rrrc_transport import RevvyTransport
+from revvy.robot.status_updater import McuStatusUpdater
+
+slots = range(0, 14)
+
+
+def setup(control):
+    updater = McuStatusUpdater(control)
+    updater.reset()
+    for slot in slots:
+        updater.set_slot(slot, lambda data: None)
+    return updater
+
+
+def record(path, reads=2000):
+    with BusRecorder(path) as recorder:
+        updater = setup(RevvyControl(RevvyTransport(RecordingTransport(McuEmulator(), recorder))))
+        for _ in range(reads):
+            updater.read()
+
+
+def run(path=None):
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'status.rec')
+        record(path)
+
+    records = read_recording(path)
+    transport = ReplayTransport(records)
+    updater = setup(RevvyControl(RevvyTransport(transport)))
+
+    reads = 0
+    start = time.perf_counter()
+    try:
+        while not transport.finished:
+            updater.read()
+            reads += 1
+    except EOFError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    print('{} records, {} reads in {:.3f}s: {:.1f}us/read, {} write mismatches'.format(
+        len(records), reads, elapsed, 1e6 * elapsed / reads, transport.mismatches))
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
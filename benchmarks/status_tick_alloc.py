@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Memory allocation of a status update tick
+
+Runs Robot.update_status on a replayed bus recording (all motors and a distance sensor configured) and measures,
+with tracemalloc:
+
+ - the number of memory blocks allocated in a tick: a snapshot is taken at every function call and return, and the
+   increase of the block count (Statistic.count) of every source line since the previous snapshot is summed up.
+   Blocks that are allocated and freed without a function call or return in between are not counted, so this is
+   a lower bound.
+ - the peak of the memory allocated within a tick
+
+and the time a tick takes without tracing. Run from the repository root:
+
+    python -m benchmarks.status_tick_alloc
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from revvy.mcu.bus_recorder import BusRecorder, RecordingTransport, ReplayTransport, read_recording
+from revvy.mcu.emulator import McuEmulator
+from revvy.mcu.rrrc_control import RevvyControl
+from revvy.mcu.rrrc_transport import RevvyTransport
+from revvy.utils import Robot
+
+
+def create_robot(transport):
+    robot = Robot(RevvyControl(RevvyTransport(transport)), {}, '0.0.0')
+    robot.reset()
+    for motor in robot.motors:
+        motor.configure('RevvyMotor')
+    robot.sensors[1].configure('HC_SR04')
+    return robot
+
+
+def record(path, ticks):
+    with BusRecorder(path) as recorder:
+        robot = create_robot(RecordingTransport(McuEmulator(), recorder))
+        for _ in range(ticks):
+            robot.update_status()
+
+
+def _traced_allocations(robot, ticks):
+    ignored = {__file__, tracemalloc.__file__}
+
+    def block_counts():
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        return {statistic.traceback[0]: statistic.count for statistic in statistics
+                if statistic.traceback[0].filename not in ignored}
+
+    allocations = 0
+    previous = {}
+
+    def take_snapshot(*_):
+        nonlocal allocations, previous
+        current = block_counts()
+        allocations += sum(max(0, count - previous.get(line, 0)) for line, count in current.items())
+        previous = current
+
+    tracemalloc.start()
+    try:
+        for _ in range(ticks):
+            previous = block_counts()
+            sys.setprofile(take_snapshot)
+            try:
+                robot.update_status()
+            finally:
+                sys.setprofile(None)
+            take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    return allocations
+
+
+def count_allocations(robot, ticks, warmup_ticks=2):
+    """Number of memory blocks allocated by Robot.update_status, per tick
+
+    The counts of the first profiled ticks are higher and vary, they are taken in a separate session and dropped."""
+    _traced_allocations(robot, warmup_ticks)
+    return _traced_allocations(robot, ticks) / ticks
+
+
+def run(ticks=2000, counted_ticks=20):
+    path = os.path.join(tempfile.mkdtemp(), 'ticks.rec')
+    record(path, ticks + counted_ticks + 110)
+
+    records = read_recording(path)
+
+    robot = create_robot(ReplayTransport(records))
+    for _ in range(100):
+        robot.update_status()
+
+    # taking the snapshots is slow, only a few ticks are counted
+    allocations = count_allocations(robot, counted_ticks)
+
+    tracemalloc.start()
+    transient = 0
+    try:
+        for _ in range(ticks):
+            tracemalloc.reset_peak()
+            (current, _) = tracemalloc.get_traced_memory()
+            robot.update_status()
+            (_, peak) = tracemalloc.get_traced_memory()
+            transient += peak - current
+    finally:
+        tracemalloc.stop()
+
+    robot = create_robot(ReplayTransport(records))
+    for _ in range(100):
+        robot.update_status()
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        robot.update_status()
+    elapsed = time.perf_counter() - start
+
+    print('{} ticks: {:.0f} blocks allocated per tick ({} ticks counted), {:.0f} bytes allocated at peak per tick, '
+          '{:.1f}us per tick'.format(ticks, allocations, counted_ticks, transient / ticks, 1e6 * elapsed / ticks))
+
+
+if __name__ == "__main__":
+    run()
@@ -6,6 +6,9 @@ from revvy.file_storage import FileStorage, MemoryStorage
 from revvy.functions import getserial, read_json
 from revvy.bluetooth.longmessage import LongMessageHandler, LongMessageStorage, LongMessageType, LongMessageStatus
 from revvy.hardware_dependent.rrrc_transport_i2c import RevvyTransportI2C
+from revvy.mcu.capability_cache import CapabilityCache
+from revvy.mcu.error_memory import ErrorMemoryLog
+from revvy.robot.telemetry_log import TelemetryLog
 from revvy.robot_config import empty_robot_config
 from revvy.utils import *
 from revvy.mcu.rrrc_transport import *
@@ -120,13 +123,18 @@ def start_revvy(config: RobotConfig = None):
 
     ble = RevvyBLE(device_name, serial, long_message_handler)
 
+    capability_cache = CapabilityCache(FileStorage(os.path.join(current_installation, 'cache')))
+    error_log = ErrorMemoryLog(os.path.join(current_installation, 'cache', 'error-memory.bin'))
+    telemetry_log = TelemetryLog(os.path.join(current_installation, 'telemetry'))
+
     # if the robot has never been configured, set the default configuration for the simple robot
     initial_config = default_robot_config
 
     with RevvyTransportI2C() as transport:
         robot_control = RevvyControl(transport.bind(0x2D))
 
-        robot = RobotManager(robot_control, ble, sound_paths, manifest['version'], initial_config)
+        robot = RobotManager(robot_control, ble, sound_paths, manifest['version'], initial_config,
+                             capability_cache, error_log, telemetry_log)
 
         lmi = LongMessageImplementation(robot, config is not None)
         long_message_handler.on_upload_started(lmi.on_upload_started)
@@ -0,0 +1,151 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""I2C transport that talks to /dev/i2c-N with I2C_RDWR ioctls
+
+Message descriptors and data buffers are allocated once per device, a transfer only fills them in and issues the
+ioctl. The ioctl function is injectable, LoopbackIoctl serves the transfers from RevvyTransportInterface objects
+(e.g. the MCU emulator) so the backend can be exercised without hardware:
+
+>>> from revvy.mcu.bus_manager import BusManager
+>>> from revvy.mcu.emulator import McuEmulator
+>>> from revvy.mcu.rrrc_control import RevvyControl
+>>> with RawI2CBus(ioctl=LoopbackIoctl({0x2D: McuEmulator()})) as bus:
+...     devices = BusManager(lambda address: RawI2CDevice(address, bus))
+...     RevvyControl(devices.bind(0x2D)).get_motor_port_amount()
+6
+"""
+
+import ctypes
+import fcntl
+import os
+import traceback
+
+from revvy.mcu.rrrc_transport import RevvyTransportInterface, TransportException
+
+# from linux/i2c.h and linux/i2c-dev.h
+I2C_M_RD = 0x0001
+I2C_RDWR = 0x0707
+
+# header + the longest payload the MCU can send
+MAX_TRANSFER_LENGTH = 5 + 255
+
+
+class I2cMsg(ctypes.Structure):
+    _fields_ = [
+        ('addr', ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('len', ctypes.c_uint16),
+        ('buf', ctypes.POINTER(ctypes.c_uint8))
+    ]
+
+
+class I2cRdwrIoctlData(ctypes.Structure):
+    _fields_ = [
+        ('msgs', ctypes.POINTER(I2cMsg)),
+        ('nmsgs', ctypes.c_uint32)
+    ]
+
+
+class LoopbackIoctl:
+    """Replaces fcntl.ioctl, serves I2C_RDWR requests from RevvyTransportInterface objects keyed by address"""
+
+    def __init__(self, devices):
+        self._devices = devices
+
+    def __call__(self, fd, request, data):
+        assert request == I2C_RDWR
+
+        for i in range(data.nmsgs):
+            msg = data.msgs[i]
+            try:
+                device = self._devices[msg.addr]
+            except KeyError:
+                raise OSError(121, 'Remote I/O error')  # EREMOTEIO, the device did not acknowledge its address
+
+            if msg.flags & I2C_M_RD:
+                response = bytes(device.read(msg.len))
+                ctypes.memmove(msg.buf, response, msg.len)
+            else:
+                device.write(ctypes.string_at(msg.buf, msg.len))
+        return 0
+
+
+class RawI2CBus:
+    """An opened /dev/i2c-N, or a fake one if an ioctl replacement is given"""
+
+    def __init__(self, bus_number=1, ioctl=None):
+        self._bus_number = bus_number
+        self._ioctl = ioctl
+        self._fd = None
+
+    def open(self):
+        if self._ioctl is None:
+            self._fd = os.open('/dev/i2c-{}'.format(self._bus_number), os.O_RDWR)
+            self._ioctl = fcntl.ioctl
+        else:
+            self._fd = -1
+
+    def close(self):
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def transfer(self, data: I2cRdwrIoctlData):
+        self._ioctl(self._fd, I2C_RDWR, data)
+
+
+class RawI2CDevice(RevvyTransportInterface):
+    """A single device on a RawI2CBus, reusing the same message and buffers for every transfer
+
+    read() returns a bytes copy of the received data, because the transport keeps parts of a response while the
+    next transfer is already in progress."""
+
+    def __init__(self, address, bus: RawI2CBus, max_transfer_length=MAX_TRANSFER_LENGTH):
+        self._bus = bus
+        self._max_length = max_transfer_length
+
+        self._read_buffer = bytearray(max_transfer_length)
+        self._read_view = memoryview(self._read_buffer)
+        self._write_buffer = bytearray(max_transfer_length)
+
+        # the message points into the bytearrays, no copy is needed between the kernel and python objects
+        self._read_msg = I2cMsg(address, I2C_M_RD, 0, self._buffer_pointer(self._read_buffer))
+        self._write_msg = I2cMsg(address, 0, 0, self._buffer_pointer(self._write_buffer))
+        self._read_data = I2cRdwrIoctlData(ctypes.pointer(self._read_msg), 1)
+        self._write_data = I2cRdwrIoctlData(ctypes.pointer(self._write_msg), 1)
+
+    @staticmethod
+    def _buffer_pointer(buffer):
+        return ctypes.cast((ctypes.c_uint8 * len(buffer)).from_buffer(buffer), ctypes.POINTER(ctypes.c_uint8))
+
+    def read(self, length):
+        if length > self._max_length:
+            raise TransportException('Read of {} bytes exceeds buffer size'.format(length))
+
+        self._read_msg.len = length
+        try:
+            self._bus.transfer(self._read_data)
+        except TypeError:
+            traceback.print_exc()
+            raise TransportException()
+        return bytes(self._read_view[0:length])
+
+    def write(self, data):
+        length = len(data)
+        if length > self._max_length:
+            raise TransportException('Write of {} bytes exceeds buffer size'.format(length))
+
+        self._write_buffer[0:length] = data
+        self._write_msg.len = length
+        try:
+            self._bus.transfer(self._write_data)
+        except TypeError:
+            traceback.print_exc()
+            raise TransportException()
@@ -1,18 +1,12 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
 from smbus2 import i2c_msg, SMBus
-from revvy.mcu.rrrc_transport import RevvyTransportInterface, RevvyTransport, TransportException
+from revvy.hardware_dependent.i2c_rdwr import RawI2CBus, RawI2CDevice
+from revvy.mcu.bus_manager import BusManager
+from revvy.mcu.rrrc_transport import RevvyTransportInterface, TransportException
 import traceback
 
 
-class RevvyTransportI2CImpl:
-    def __init__(self, bus):
-        self._bus = bus
-
-    def bind(self, address):
-        return RevvyTransport(RevvyTransportI2CDevice(address, self._bus))
-
-
 class RevvyTransportI2CDevice(RevvyTransportInterface):
     def __init__(self, address, bus):
         self._address = address
@@ -25,7 +19,7 @@ class RevvyTransportI2CDevice(RevvyTransportInterface):
         except TypeError:
             traceback.print_exc()
             raise TransportException()
-        return list(read_msg)
+        return bytes(read_msg)
 
     def write(self, data):
         try:
@@ -37,9 +31,23 @@ class RevvyTransportI2CDevice(RevvyTransportInterface):
 
 
 class RevvyTransportI2C:
+    """Opens the I2C bus of the MCU
+
+    By default the bus is accessed via smbus2, raw=True selects the buffer-reusing I2C_RDWR backend instead.
+    Returns a BusManager, bind() can be called for every MCU address that needs to be accessed."""
+
+    def __init__(self, bus_number=1, raw=False):
+        self._bus_number = bus_number
+        self._raw = raw
+
     def __enter__(self):
-        self._bus = SMBus(1)
-        return RevvyTransportI2CImpl(self._bus)
+        if self._raw:
+            self._bus = RawI2CBus(self._bus_number)
+            self._bus.open()
+            return BusManager(lambda address: RawI2CDevice(address, self._bus))
+        else:
+            self._bus = SMBus(self._bus_number)
+            return BusManager(lambda address: RevvyTransportI2CDevice(address, self._bus))
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._bus.close()
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from revvy.mcu.commands import Command
+from revvy.mcu.rrrc_control import RevvyControl
+
+
+class AsyncCommand:
+    """Awaitable version of a command, executed by the bus worker of AsyncRevvyControl"""
+
+    def __init__(self, command: Command, executor: ThreadPoolExecutor):
+        self._command = command
+        self._executor = executor
+
+    @property
+    def command_id(self):
+        return self._command.command_id
+
+    def __call__(self, *args, **kwargs):
+        return asyncio.get_running_loop().run_in_executor(self._executor, partial(self._command, *args, **kwargs))
+
+
+class AsyncRevvyControl:
+    """Exposes every command of a RevvyControl as a coroutine
+
+    The commands are executed one by one on a single worker thread that owns the bus, so any number of coroutines
+    can talk to the MCU without a thread of their own. Blocking callers of the same RevvyControl keep working, the
+    transport serializes them with the worker. The commands have to be called from a running event loop.
+
+    >>> from revvy.mcu.emulator import RevvyTransportEmulator
+    >>> async def read_ports(control):
+    ...     return await asyncio.gather(control.get_motor_port_amount(), control.get_sensor_port_amount())
+    >>> with RevvyTransportEmulator() as transport:
+    ...     with AsyncRevvyControl(RevvyControl(transport.bind(0x2D))) as control:
+    ...         asyncio.run(read_ports(control))
+    [6, 4]
+    """
+
+    def __init__(self, control: RevvyControl):
+        self._control = control
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='McuBusWorker')
+
+        for name, command in vars(control).items():
+            if isinstance(command, Command):
+                setattr(self, name, AsyncCommand(command, self._executor))
+
+    @property
+    def control(self):
+        """The wrapped, blocking RevvyControl"""
+        return self._control
+
+    @property
+    def transport_metrics(self):
+        return self._control.transport_metrics
+
+    def run(self, func, *args):
+        """Run a blocking function on the bus worker, e.g. to send a batch of commands"""
+        return asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    def close(self):
+        """Wait for the submitted commands to finish and stop the bus worker"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+from threading import Lock, Event
+
+
+class Priority:
+    """Bus access classes, lower value is served first"""
+    Realtime = 0  # motor and drivetrain setpoints
+    Telemetry = 1  # periodic status reads
+    Configuration = 2
+    Bulk = 3  # firmware update, error memory
+
+    names = ('realtime', 'telemetry', 'configuration', 'bulk')
+
+
+class _BusRequest:
+    __slots__ = ('priority', 'sequence', 'requested_at', 'granted')
+
+    def __init__(self, priority, sequence, requested_at):
+        self.priority = priority
+        self.sequence = sequence
+        self.requested_at = requested_at
+        self.granted = Event()
+
+
+class BusArbiter:
+    """Replaces a plain lock around bus transactions: when the bus is released, the waiting request with the highest
+    priority gets it, requests of the same class are served in arrival order
+
+    Transactions are not preempted, but the transport gives up the bus while it waits for a pending command, and
+    hands it over between the commands of a batch if a more urgent request is waiting. A Realtime request waits at
+    most for the command in progress and for the Realtime requests that arrived before it. The command in progress
+    includes the time the MCU answers "busy": the bus is kept then, because a new command would replace the response
+    the MCU is preparing. That backoff is bounded by the transport timeout, a responsive MCU is busy for a few ms.
+
+    Configuration and Bulk requests are promoted by one class for every aging_interval they spend waiting, up to
+    Telemetry, so they can not starve either.
+
+    >>> arbiter = BusArbiter()
+    >>> arbiter.acquire(Priority.Bulk)
+    0.0
+    >>> arbiter.handover(Priority.Bulk)
+    0.0
+    >>> arbiter.release()
+    """
+
+    aging_interval = 0.1  # [seconds]
+
+    def __init__(self):
+        self._lock = Lock()
+        self._busy = False
+        self._waiting = []
+        self._sequence = 0
+
+    def acquire(self, priority):
+        """Wait for the bus, return the time spent waiting"""
+        with self._lock:
+            if not self._busy:
+                self._busy = True
+                return 0.0
+
+            requested_at = time.monotonic()
+            request = _BusRequest(priority, self._sequence, requested_at)
+            self._sequence += 1
+            self._waiting.append(request)
+
+        request.granted.wait()
+        return time.monotonic() - requested_at
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self._busy = False
+                return
+
+            now = time.monotonic()
+            next_request = min(self._waiting, key=lambda r: (self._effective_priority(r, now), r.sequence))
+            self._waiting.remove(next_request)
+
+        # the bus is handed over without becoming free
+        next_request.granted.set()
+
+    def handover(self, priority):
+        """Let the waiting requests that are more urgent than priority use the bus, then take it back
+
+        Returns the time spent waiting for the bus to come back."""
+        with self._lock:
+            now = time.monotonic()
+            if not any(self._effective_priority(r, now) < priority for r in self._waiting):
+                return 0.0
+
+        self.release()
+        return self.acquire(priority)
+
+    def _effective_priority(self, request, now):
+        if request.priority <= Priority.Telemetry:
+            return request.priority
+        promotion = int((now - request.requested_at) / self.aging_interval)
+        return max(Priority.Telemetry, request.priority - promotion)
@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+
+from revvy.mcu.bus_arbiter import BusArbiter
+from revvy.mcu.rrrc_transport import RevvyTransportInterface, RevvyTransport
+
+
+class DeviceStatistics:
+    def __init__(self):
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.errors = 0
+        self.bus_time = 0.0  # [seconds] time spent in transfers
+
+    def snapshot(self):
+        return {
+            'writes':        self.writes,
+            'reads':         self.reads,
+            'bytes_written': self.bytes_written,
+            'bytes_read':    self.bytes_read,
+            'errors':        self.errors,
+            'bus_time':      self.bus_time
+        }
+
+
+class ManagedDevice(RevvyTransportInterface):
+    """A device on a managed bus, counts the transfers it makes"""
+
+    def __init__(self, address, device: RevvyTransportInterface):
+        self._address = address
+        self._device = device
+        self._statistics = DeviceStatistics()
+
+    @property
+    def address(self):
+        return self._address
+
+    @property
+    def statistics(self):
+        return self._statistics
+
+    def read(self, length):
+        start = time.monotonic()
+        try:
+            data = self._device.read(length)
+        except Exception:
+            self._statistics.errors += 1
+            raise
+        finally:
+            self._statistics.bus_time += time.monotonic() - start
+
+        self._statistics.reads += 1
+        self._statistics.bytes_read += length
+        return data
+
+    def write(self, data):
+        start = time.monotonic()
+        try:
+            self._device.write(data)
+        except Exception:
+            self._statistics.errors += 1
+            raise
+        finally:
+            self._statistics.bus_time += time.monotonic() - start
+
+        self._statistics.writes += 1
+        self._statistics.bytes_written += len(data)
+
+
+class BusManager:
+    """Owns the devices of a bus and hands out one transport per address
+
+    The transports share a single BusArbiter, so transactions to different devices (e.g. the application and the
+    bootloader MCU during a firmware update) never interleave on the bus. Waiting transactions are served by priority
+    class and in arrival order within a class, regardless of the device they are addressed to.
+
+    >>> from revvy.mcu.emulator import McuEmulator
+    >>> bus = BusManager(lambda address: McuEmulator())
+    >>> bus.bind(0x2D) is bus.bind(0x2D)
+    True
+    >>> list(bus.bind(0x2D).send_command(0x10).payload)
+    [6]
+    >>> bus.device_statistics[0x2D]['writes']
+    1
+    """
+
+    def __init__(self, device_factory):
+        self._device_factory = device_factory
+        self._arbiter = BusArbiter()
+        self._devices = {}
+        self._transports = {}
+
+    def bind(self, address) -> RevvyTransport:
+        if address not in self._transports:
+            device = ManagedDevice(address, self._device_factory(address))
+            self._devices[address] = device
+            self._transports[address] = RevvyTransport(device, self._arbiter)
+        return self._transports[address]
+
+    @property
+    def device_statistics(self):
+        return {address: device.statistics.snapshot() for address, device in self._devices.items()}
@@ -0,0 +1,232 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Recording and replay of the raw traffic between RevvyTransport and the MCU
+
+The recording is a memory mapped ring file: a fixed size header followed by the record area. When the area is full,
+the oldest records are overwritten. Each record is a (kind, length, monotonic timestamp) header and the bytes that
+were written to or read from the bus.
+
+>>> import os, tempfile
+>>> from revvy.mcu.emulator import McuEmulator
+>>> from revvy.mcu.rrrc_control import RevvyControl
+>>> from revvy.mcu.rrrc_transport import RevvyTransport
+>>> path = os.path.join(tempfile.mkdtemp(), 'bus.rec')
+>>> with BusRecorder(path, capacity=4096) as recorder:
+...     RevvyControl(RevvyTransport(RecordingTransport(McuEmulator(), recorder))).get_motor_port_amount()
+6
+>>> [kind for kind, timestamp, data in read_recording(path)]
+[1, 2]
+>>> RevvyControl(RevvyTransport(ReplayTransport(read_recording(path)))).get_motor_port_amount()
+6
+"""
+
+import mmap
+import struct
+import time
+from threading import Lock
+
+from revvy.mcu.rrrc_transport import RevvyTransportInterface
+
+RECORD_PADDING = 0
+RECORD_WRITE = 1
+RECORD_READ = 2
+
+_file_header = struct.Struct('<4sHIIIQ')  # magic, version, capacity, head, used, overwritten records
+_record_header = struct.Struct('<BHd')  # kind, length, timestamp
+
+_magic = b'RVBR'
+_version = 1
+
+
+class BusRecorder:
+    """Appends bus records to a memory mapped ring file"""
+
+    def __init__(self, path, capacity=4 * 1024 * 1024):
+        self._path = path
+        self._capacity = capacity
+        self._lock = Lock()
+        self._file = None
+        self._map = None
+
+        self._head = 0
+        self._used = 0
+        self._overwritten = 0
+
+    @property
+    def overwritten(self):
+        """Number of records lost because the ring was full"""
+        return self._overwritten
+
+    def open(self):
+        self._file = open(self._path, 'w+b')
+        self._file.truncate(_file_header.size + self._capacity)
+        self._map = mmap.mmap(self._file.fileno(), _file_header.size + self._capacity)
+        self._write_header()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, kind, timestamp, data):
+        length = _record_header.size + len(data)
+        if length > self._capacity:
+            raise ValueError('Record does not fit into the recording')
+
+        with self._lock:
+            tail = (self._head + self._used) % self._capacity
+            if self._capacity - tail < length:
+                # the record would not fit before the end of the area, mark the rest as unused and start over
+                padding = self._capacity - tail
+                self._make_room(padding)
+                self._map[_file_header.size + tail] = RECORD_PADDING
+                self._used += padding
+                tail = 0
+
+            self._make_room(length)
+
+            offset = _file_header.size + tail
+            _record_header.pack_into(self._map, offset, kind, len(data), timestamp)
+            self._map[offset + _record_header.size:offset + length] = data
+            self._used += length
+
+            self._write_header()
+
+    def _make_room(self, length):
+        while self._capacity - self._used < length:
+            skipped = _record_length(self._map, self._head, self._capacity)
+            if skipped is None:
+                skipped = self._capacity - self._head
+            else:
+                self._overwritten += 1
+            self._head = (self._head + skipped) % self._capacity
+            self._used -= skipped
+
+    def _write_header(self):
+        _file_header.pack_into(self._map, 0, _magic, _version, self._capacity, self._head, self._used,
+                               self._overwritten)
+
+
+def _record_length(buffer, position, capacity):
+    """Return the length of the record at the given position of the record area, or None for padding"""
+    if capacity - position < _record_header.size or buffer[_file_header.size + position] == RECORD_PADDING:
+        return None
+    (_, length, _) = _record_header.unpack_from(buffer, _file_header.size + position)
+    return _record_header.size + length
+
+
+def read_recording(path):
+    """Return the (kind, timestamp, data) records of a recording, oldest first"""
+    with open(path, 'rb') as f:
+        buffer = f.read()
+
+    (magic, version, capacity, head, used, _) = _file_header.unpack_from(buffer, 0)
+    if magic != _magic or version != _version:
+        raise ValueError('{} is not a bus recording'.format(path))
+
+    records = []
+    position = head
+    remaining = used
+    while remaining > 0:
+        length = _record_length(buffer, position, capacity)
+        if length is None:
+            length = capacity - position
+        else:
+            (kind, data_length, timestamp) = _record_header.unpack_from(buffer, _file_header.size + position)
+            data_start = _file_header.size + position + _record_header.size
+            records.append((kind, timestamp, buffer[data_start:data_start + data_length]))
+
+        position = (position + length) % capacity
+        remaining -= length
+
+    return records
+
+
+class RecordingTransport(RevvyTransportInterface):
+    """Passes the traffic through to the wrapped transport and records it"""
+
+    def __init__(self, transport: RevvyTransportInterface, recorder: BusRecorder):
+        self._transport = transport
+        self._recorder = recorder
+
+    def read(self, length):
+        timestamp = time.monotonic()
+        data = self._transport.read(length)
+        self._recorder.record(RECORD_READ, timestamp, bytes(data))
+        return data
+
+    def write(self, data):
+        self._recorder.record(RECORD_WRITE, time.monotonic(), bytes(data))
+        self._transport.write(data)
+
+
+class ReplayTransport(RevvyTransportInterface):
+    """Plays back a recording in place of the MCU
+
+    The replay does not need to read exactly like the recorded session did: like the MCU, it answers every read with
+    the last response until the next write. A mismatch between a write and the recorded one is counted, not raised.
+    With realtime=True the responses are delayed to follow the recorded timing, otherwise they are returned
+    immediately."""
+
+    def __init__(self, records, realtime=False):
+        self._records = list(records)
+        self._realtime = realtime
+        self._position = 0
+        self._response = b''
+        self._started = None
+        self._mismatches = 0
+
+    @property
+    def mismatches(self):
+        return self._mismatches
+
+    @property
+    def finished(self):
+        return self._position >= len(self._records)
+
+    def write(self, data):
+        # skip the responses that the replaying side did not read
+        while not self.finished and self._records[self._position][0] != RECORD_WRITE:
+            self._position += 1
+
+        if self.finished:
+            raise EOFError('End of recording')
+
+        (_, timestamp, recorded) = self._records[self._position]
+        self._position += 1
+        self._wait_until(timestamp)
+
+        if bytes(data) != recorded:
+            self._mismatches += 1
+
+    def read(self, length):
+        if not self.finished and self._records[self._position][0] == RECORD_READ:
+            (_, timestamp, self._response) = self._records[self._position]
+            self._position += 1
+            self._wait_until(timestamp)
+
+        response = self._response[0:length]
+        return response + bytes(length - len(response))
+
+    def _wait_until(self, timestamp):
+        if not self._realtime:
+            return
+
+        now = time.monotonic()
+        if self._started is None:
+            self._started = (now, timestamp)
+        else:
+            (replay_start, recording_start) = self._started
+            delay = (timestamp - recording_start) - (now - replay_start)
+            if delay > 0:
+                time.sleep(delay)
@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import json
+from collections import namedtuple
+
+from revvy.file_storage import StorageInterface, StorageError
+from revvy.mcu.rrrc_control import RevvyControl
+
+McuCapabilities = namedtuple('McuCapabilities', ['motor_port_amount', 'motor_port_types',
+                                                 'sensor_port_amount', 'sensor_port_types',
+                                                 'ring_led_amount'])
+
+
+def read_capabilities(interface: RevvyControl):
+    """Query the static properties of the MCU firmware"""
+    return McuCapabilities(
+        motor_port_amount=interface.get_motor_port_amount(),
+        motor_port_types=interface.get_motor_port_types(),
+        sensor_port_amount=interface.get_sensor_port_amount(),
+        sensor_port_types=interface.get_sensor_port_types(),
+        ring_led_amount=interface.ring_led_get_led_amount())
+
+
+class CapabilityCache:
+    """Stores the MCU capabilities so that they don't have to be queried on every start
+
+    The capabilities are determined by the hardware and firmware versions, which have to be read on startup anyway:
+    the stored capabilities are only returned if both versions match the ones they were read with.
+
+    >>> from revvy.file_storage import MemoryStorage
+    >>> from revvy.mcu.emulator import McuEmulator
+    >>> from revvy.mcu.rrrc_transport import RevvyTransport
+    >>> from revvy.version import Version
+    >>> control = RevvyControl(RevvyTransport(McuEmulator()))
+    >>> cache = CapabilityCache(MemoryStorage())
+    >>> (hw, fw) = (control.get_hardware_version(), control.get_firmware_version())
+    >>> cache.load(hw, fw) is None
+    True
+    >>> cache.store(hw, fw, read_capabilities(control))
+    >>> cache.load(hw, fw).motor_port_amount
+    6
+    >>> cache.load(hw, Version('0.1.0')) is None
+    True
+    """
+
+    filename = 'mcu-capabilities'
+
+    def __init__(self, storage: StorageInterface):
+        self._storage = storage
+
+    def load(self, hw_version, fw_version):
+        """Return the stored capabilities if they belong to the given versions, None otherwise"""
+        if hw_version is None or fw_version is None:
+            return None
+
+        try:
+            data = json.loads(self._storage.read(self.filename).decode())
+            if data['hw'] != str(hw_version) or data['fw'] != str(fw_version):
+                return None
+            return McuCapabilities(**data['capabilities'])
+        except StorageError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            print('CapabilityCache: ignoring invalid cache ({})'.format(e))
+            return None
+
+    def store(self, hw_version, fw_version, capabilities: McuCapabilities):
+        if hw_version is None or fw_version is None:
+            return
+
+        data = {'hw': str(hw_version), 'fw': str(fw_version), 'capabilities': capabilities._asdict()}
+        try:
+            self._storage.write(self.filename, json.dumps(data).encode())
+        except (StorageError, IOError) as e:
+            print('CapabilityCache: failed to store capabilities ({})'.format(e))
@@ -1,11 +1,15 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
 import struct
+import sys
 import traceback
 from abc import ABC
+from array import array
 from collections import namedtuple
+from functools import lru_cache
 
 from revvy.functions import split
+from revvy.mcu.bus_arbiter import Priority
 from revvy.version import Version, FormatError
 from revvy.mcu.rrrc_transport import RevvyTransport, Response, ResponseHeader
 
@@ -15,7 +19,47 @@ class UnknownCommandError(Exception):
 
 
 class Command:
-    """A generic command towards the MCU"""
+    """A generic command towards the MCU
+
+    Commands with a fixed payload layout declare it as struct formats. The formats are compiled once per class: the
+    arguments of __call__ are packed with request_format, and parse_response unpacks the response with
+    response_format, which also gives max_response_length.
+
+    >>> SetPortTypeCommand.request_format
+    '<BB'
+    >>> ErrorMemory_ReadCount.max_response_length
+    4
+    """
+
+    # [seconds] typical execution time of commands that the MCU completes asynchronously. This is only a starting
+    # point for polling the result, the transport refines it using the observed completion times
+    expected_latency = 0
+
+    # [bytes] length of the response payload if it is known in advance. The transport reads this many bytes together
+    # with the response header, saving a bus transaction. Learned from the responses if not declared
+    max_response_length = 0
+
+    # bus access class, commands of a more urgent class are sent first when the bus is contended
+    priority = Priority.Configuration
+
+    # struct format of the request payload, or of its fixed head if the command has a variable length tail
+    request_format = None
+
+    # struct format of the response payload, a single field is returned as a value, more fields as a tuple
+    response_format = None
+
+    _request = None
+    _response = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'request_format' in cls.__dict__:
+            cls._request = struct.Struct(cls.request_format)
+        if 'response_format' in cls.__dict__:
+            cls._response = struct.Struct(cls.response_format)
+            if 'max_response_length' not in cls.__dict__:
+                cls.max_response_length = cls._response.size
+
     def __init__(self, transport: RevvyTransport):
         self._transport = transport
         self._command_byte = self.command_id
@@ -36,11 +80,12 @@ class Command:
 
             raise ValueError('Command status: "{}" with payload: {}'.format(status, repr(response.payload)))
 
-    def _send(self, payload=None):
+    def _send(self, payload=b''):
         """Send the command with the given payload and process the response"""
-        if payload is None:
-            payload = []
         response = self._transport.send_command(self._command_byte, payload)
+        if response is None:
+            # command was queued (e.g. into a CommandBatch), the response will be processed by the queue owner
+            return None
 
         try:
             return self._process(response)
@@ -50,12 +95,19 @@ class Command:
             raise e
 
     def __call__(self, *args):
+        if self._request is not None:
+            return self._send(self._request.pack(*args))
+
         if args:
             raise NotImplementedError
 
         return self._send()
 
     def parse_response(self, payload):
+        if self._response is not None:
+            values = self._response.unpack(payload)
+            return values[0] if len(values) == 1 else values
+
         if payload:
             raise NotImplementedError
 
@@ -89,32 +141,25 @@ BatteryStatus = namedtuple('BatteryStatus', ['chargerStatus', 'main', 'motor'])
 
 
 class SetMasterStatusCommand(Command):
+    request_format = '<B'  # TODO: make this accept something meaningful
+
     @property
     def command_id(self): return 0x04
 
-    def __call__(self, status):
-        # TODO: make this accept something meaningful
-        return self._send([status])
-
 
 class SetBluetoothStatusCommand(Command):
+    request_format = '<B'  # TODO: make this accept something meaningful
+
     @property
     def command_id(self): return 0x05
 
-    def __call__(self, status):
-        # TODO: make this accept something meaningful
-        return self._send([status])
-
 
 class ReadOperationModeCommand(Command):
+    response_format = '<B'  # TODO: make this return something meaningful
+
     @property
     def command_id(self): return 0x06
 
-    def parse_response(self, payload):
-        # TODO: make this return something meaningful
-        assert len(payload) == 1
-        return int(payload[0])
-
 
 class RebootToBootloaderCommand(Command):
     @property
@@ -145,9 +190,7 @@ class ReadRingLedScenarioTypesCommand(Command):
 
 
 class ReadPortAmountCommand(Command, ABC):
-    def parse_response(self, payload):
-        assert len(payload) == 1
-        return int(payload[0])
+    response_format = '<B'
 
 
 class ReadMotorPortAmountCommand(ReadPortAmountCommand):
@@ -161,8 +204,8 @@ class ReadSensorPortAmountCommand(ReadPortAmountCommand):
 
 
 class SetPortTypeCommand(Command, ABC):
-    def __call__(self, port, port_type_idx):
-        return self._send([port, port_type_idx])
+    expected_latency = 0.002
+    request_format = '<BB'  # port, port type index
 
 
 class SetMotorPortTypeCommand(SetPortTypeCommand):
@@ -176,70 +219,76 @@ class SetSensorPortTypeCommand(SetPortTypeCommand):
 
 
 class SetRingLedScenarioCommand(Command):
+    request_format = '<B'  # scenario index
+
     @property
     def command_id(self): return 0x31
 
-    def __call__(self, scenario_idx):
-        return self._send([scenario_idx])
-
 
 class GetRingLedAmountCommand(Command):
+    response_format = '<B'
+
     @property
     def command_id(self): return 0x32
 
-    def parse_response(self, payload):
-        assert len(payload) == 1
-        return int(payload[0])
-
 
 class SendRingLedUserFrameCommand(Command):
     @property
     def command_id(self): return 0x33
 
     def __call__(self, colors):
-        rgb565_values = list(map(rgb_to_rgb565_bytes, colors))
-        led_bytes = list(struct.pack("<" + "H" * len(rgb565_values), *rgb565_values))
-        return self._send(led_bytes)
+        return self._send(encode_user_frame(colors))
 
 
 class ConfigureDrivetrain(Command):
+    request_format = '<B'  # drivetrain type, followed by the motor assignments
+
     @property
     def command_id(self): return 0x1A
 
     def __call__(self, drivetrain_type, config):
-        return self._send([drivetrain_type, *config])
+        return self._send(self._request.pack(drivetrain_type) + bytes(config))
 
 
 class RequestDifferentialDriveTrainSpeedCommand(Command):
+    priority = Priority.Realtime
+    request_format = '<bffb'  # request type, left, right, power limit
+
     @property
     def command_id(self): return 0x1B
 
     def __call__(self, left, right, power_limit=0):
-        speed_cmd = list(struct.pack('<bffb', 1, left, right, power_limit))
-        return self._send(speed_cmd)
+        return self._send(self._request.pack(1, left, right, power_limit))
 
 
 class RequestDifferentialDriveTrainPositionCommand(Command):
+    priority = Priority.Realtime
+    request_format = '<bllffb'  # request type, left, right, left speed, right speed, power limit
+
     @property
     def command_id(self): return 0x1B
 
     def __call__(self, left, right, left_speed=0, right_speed=0, power_limit=0):
-        pos_cmd = list(struct.pack('<bllffb', 0, left, right, left_speed, right_speed, power_limit))
-        return self._send(pos_cmd)
+        return self._send(self._request.pack(0, left, right, left_speed, right_speed, power_limit))
 
 
 class RequestDifferentialDriveTrainTurnCommand(Command):
+    priority = Priority.Realtime
+    request_format = '<blfb'  # request type, turn angle, wheel speed, power limit
+
     @property
     def command_id(self): return 0x1B
 
     def __call__(self, turn_angle, wheel_speed=0, power_limit=0):
-        turn_cmd = list(struct.pack('<blfb', 3, turn_angle, wheel_speed, power_limit))
-        return self._send(turn_cmd)
+        return self._send(self._request.pack(3, turn_angle, wheel_speed, power_limit))
 
 
 class SetPortConfigCommand(Command, ABC):
+    expected_latency = 0.002
+    request_format = '<B'  # port, followed by the driver specific configuration
+
     def __call__(self, port_idx, config):
-        return self._send([port_idx] + config)
+        return self._send(self._request.pack(port_idx) + bytes(config))
 
 
 class SetMotorPortConfigCommand(SetPortConfigCommand):
@@ -253,16 +302,19 @@ class SetSensorPortConfigCommand(SetPortConfigCommand):
 
 
 class SetMotorPortControlCommand(Command):
+    priority = Priority.Realtime
+    request_format = '<B'  # port, followed by the control request
+
     @property
     def command_id(self): return 0x14
 
     def __call__(self, port_idx, control):
-        return self._send([port_idx] + control)
+        return self._send(self._request.pack(port_idx) + bytes(control))
 
 
 class ReadPortStatusCommand(Command, ABC):
-    def __call__(self, port_idx):
-        return self._send([port_idx])
+    priority = Priority.Telemetry
+    request_format = '<B'  # port
 
     def parse_response(self, payload):
         """Return the raw response"""
@@ -285,14 +337,15 @@ class McuStatusUpdater_ResetCommand(Command):
 
 
 class McuStatusUpdater_ControlCommand(Command):
+    request_format = '<B?'  # slot, is enabled
+
     @property
     def command_id(self): return 0x3B
 
-    def __call__(self, slot, is_enabled: bool):
-        return self._send([slot, is_enabled])
-
 
 class McuStatusUpdater_ReadCommand(Command):
+    priority = Priority.Telemetry
+
     @property
     def command_id(self): return 0x3C
 
@@ -302,45 +355,55 @@ class McuStatusUpdater_ReadCommand(Command):
 
 
 class ErrorMemory_ReadCount(Command):
+    priority = Priority.Bulk
+    response_format = '<L'
+
     @property
     def command_id(self): return 0x3D
 
-    def parse_response(self, payload):
-        assert len(payload) == 4
-        return int.from_bytes(payload, byteorder='little')
-
 
 class ErrorMemory_ReadErrors(Command):
+    priority = Priority.Bulk
+    request_format = '<L'  # index of the first error to read
+
     @property
     def command_id(self): return 0x3E
 
     def __call__(self, start_idx=0):
-        return self._send(start_idx.to_bytes(4, byteorder='little'))
+        return self._send(self._request.pack(start_idx))
 
     def parse_response(self, payload):
         return list(split(payload, 63))
 
 
 class ErrorMemory_Clear(Command):
+    priority = Priority.Bulk
+
     @property
     def command_id(self): return 0x3F
 
 
 class ErrorMemory_TestError(Command):
+    priority = Priority.Bulk
+
     @property
     def command_id(self): return 0x40
 
 
 # Bootloader-specific commands:
 class InitializeUpdateCommand(Command):
+    priority = Priority.Bulk
+    expected_latency = 0.5  # flash erase
+    request_format = '<LL'  # crc, length
+
     @property
     def command_id(self): return 0x08
 
-    def __call__(self, crc, length):
-        return self._send(list(struct.pack("<LL", crc, length)))
-
 
 class SendFirmwareCommand(Command):
+    priority = Priority.Bulk
+    expected_latency = 0.005
+
     @property
     def command_id(self): return 0x09
 
@@ -349,6 +412,8 @@ class SendFirmwareCommand(Command):
 
 
 class FinalizeUpdateCommand(Command):
+    priority = Priority.Bulk
+
     @property
     def command_id(self): return 0x0A
 
@@ -383,6 +448,26 @@ def parse_string_list(data):
     return val
 
 
+def encode_user_frame(colors):
+    """
+    Convert a list of 24bit colors to the payload of SendRingLedUserFrameCommand
+
+    Scripts tend to upload the same few frames repeatedly, so the encoded frames are cached by their content.
+
+    >>> encode_user_frame([0, 0x800000, 0xFFFFFF])
+    b'\\x00\\x00\\x00\\x80\\xff\\xff'
+    """
+    return _encode_user_frame(tuple(colors))
+
+
+@lru_cache(maxsize=32)
+def _encode_user_frame(colors):
+    frame = array('H', map(rgb_to_rgb565_bytes, colors))
+    if sys.byteorder != 'little':
+        frame.byteswap()
+    return frame.tobytes()
+
+
 def rgb_to_rgb565_bytes(rgb):
     """
     Convert 24bit color to 16bit
@@ -0,0 +1,131 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+from threading import Lock
+
+from revvy.mcu.rrrc_transport import RevvyTransport, ResponseHeader
+
+
+class ConfigJournal:
+    """Remembers the configuration commands the MCU has acknowledged, so that they can be replayed after a reset
+
+    Only the last payload is kept for each command, or for each (command, port) for commands registered with
+    key_by_port. Some commands invalidate the state set by others (setting a port type resets the port
+    configuration), these relations are registered with clears(). Only the commands registered with track() are
+    recorded.
+
+    Entries are replayed in the order of the commands given to replay_order(), e.g. port types ahead of the port
+    configurations, whatever order they were recorded in. Entries of the same command, and of the commands that are
+    not listed, keep the order they were first recorded in, the latter are replayed last.
+
+    >>> from revvy.mcu.emulator import McuEmulator
+    >>> journal = ConfigJournal(RevvyTransport(McuEmulator()))
+    >>> journal.track(0x12, 0x31)
+    >>> journal.key_by_port(0x12)
+    >>> _ = journal.send_command(0x12, [1, 1])
+    >>> _ = journal.send_command(0x31, [2])
+    >>> _ = journal.send_command(0x12, [1, 1])
+    >>> journal.entries
+    [(18, b'\\x01\\x01'), (49, b'\\x02')]
+
+    Reconfiguring a port re-records its configuration after the drivetrain, the replay still sends the port
+    configuration first:
+
+    >>> journal = ConfigJournal(RevvyTransport(McuEmulator()))
+    >>> journal.track(0x12, 0x13, 0x1A)
+    >>> journal.key_by_port(0x12)
+    >>> journal.key_by_port(0x13)
+    >>> journal.clears(0x12, 0x13)
+    >>> journal.replay_order(0x12, 0x13, 0x1A)
+    >>> for command, payload in ((0x12, [1, 1]), (0x13, [1, 5]), (0x1A, [0, 1, 0, 0, 0, 0, 0]),
+    ...                          (0x12, [1, 0]), (0x12, [1, 1]), (0x13, [1, 6])):
+    ...     _ = journal.send_command(command, payload)
+    >>> [(command, list(payload)) for command, payload in journal.entries]
+    [(18, [1, 1]), (19, [1, 6]), (26, [0, 1, 0, 0, 0, 0, 0])]
+    >>> [response.status for response in journal.replay()]
+    [0, 0, 0]
+    """
+
+    def __init__(self, transport: RevvyTransport):
+        self._transport = transport
+        self._commands = set()
+        self._port_commands = set()
+        self._clears = {}
+        self._order = {}
+        self._lock = Lock()
+        self._entries = {}
+
+        self._replays = 0
+        self._last_replay_time = None
+
+    def track(self, *commands):
+        self._commands.update(commands)
+
+    def key_by_port(self, command):
+        self._port_commands.add(command)
+
+    def clears(self, command, cleared_command):
+        """Recording command drops the entries of cleared_command: the ones for the same port if both are keyed by
+        port, all of them otherwise"""
+        self._clears.setdefault(command, []).append(cleared_command)
+
+    def replay_order(self, *commands):
+        """Replay the entries of the commands in the given order, see the class documentation"""
+        self._order = {command: rank for rank, command in enumerate(commands)}
+
+    @property
+    def entries(self):
+        """The (command, payload) pairs that restore the recorded configuration, in replay order"""
+        with self._lock:
+            entries = list(self._entries.values())
+
+        last = len(self._order)
+        return sorted(entries, key=lambda entry: self._order.get(entry[0], last))
+
+    @property
+    def replays(self):
+        return self._replays
+
+    @property
+    def last_replay_time(self):
+        """[seconds] time it took to send the last replay, None if there was none"""
+        return self._last_replay_time
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def record(self, command, payload):
+        """Add an acknowledged command to the journal"""
+        if command not in self._commands:
+            return
+
+        payload = bytes(payload)
+        is_port_command = command in self._port_commands
+        key = (command, payload[0]) if is_port_command else (command, None)
+
+        with self._lock:
+            for cleared in self._clears.get(command, []):
+                if is_port_command and cleared in self._port_commands:
+                    self._entries.pop((cleared, payload[0]), None)
+                else:
+                    self._entries = {k: v for k, v in self._entries.items() if k[0] != cleared}
+
+            self._entries[key] = (command, payload)
+
+    def send_command(self, command, payload=bytes()):
+        response = self._transport.send_command(command, payload)
+        if response is not None and response.status == ResponseHeader.Status_Ok:
+            self.record(command, payload)
+        return response
+
+    def replay(self):
+        """Send the recorded configuration in a single batch, return the responses"""
+        entries = self.entries
+
+        start = time.monotonic()
+        responses = self._transport.send_batch(entries)
+        self._last_replay_time = time.monotonic() - start
+        self._replays += 1
+
+        return responses
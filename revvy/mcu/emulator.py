@@ -0,0 +1,501 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import binascii
+import random
+import struct
+import time
+from threading import Lock
+
+from revvy.mcu.bus_manager import BusManager
+from revvy.mcu.frame_codec import crc7, HEADER_LENGTH
+from revvy.mcu.rrrc_transport import RevvyTransportInterface, Command, ResponseHeader
+
+
+class FaultInjection:
+    """Probabilities of the faults the emulator injects into the communication"""
+
+    def __init__(self, header_corruption=0.0, payload_corruption=0.0, command_integrity_error=0.0, busy=0.0,
+                 seed=None):
+        self.header_corruption = header_corruption  # a read returns a response with damaged header checksum
+        self.payload_corruption = payload_corruption  # a read returns a response with damaged payload
+        self.command_integrity_error = command_integrity_error  # a received command is reported as corrupted
+        self.busy = busy  # a read returns "busy" before the real response
+        self.random = random.Random(seed)
+
+    def happens(self, probability):
+        return probability > 0 and self.random.random() < probability
+
+
+def _encode_string_list(strings: dict):
+    """
+    >>> _encode_string_list({'foobar': 1})
+    b'\\x01\\x06foobar'
+    """
+    data = bytearray()
+    for name, idx in strings.items():
+        data += bytes([idx, len(name)]) + name.encode('utf-8')
+    return bytes(data)
+
+
+class _EmulatedMotor:
+    CONTROL_POWER = 0
+    CONTROL_SPEED = 1
+    CONTROL_POSITION = 2
+    CONTROL_POSITION_RELATIVE = 3
+
+    max_speed = 900  # [deg/s]
+
+    def __init__(self):
+        self.port_type = 0
+        self.config = b''
+        self.position = 0.0
+        self.speed = 0.0
+        self.power = 0
+        self._target_speed = 0.0
+        self._target_position = None
+        self._speed_limit = self.max_speed
+
+    def control(self, data):
+        ctrl = data[0]
+        if ctrl == self.CONTROL_POWER:
+            self.set_power(struct.unpack_from('<b', data, 1)[0])
+        elif ctrl == self.CONTROL_SPEED:
+            self.set_speed(struct.unpack_from('<f', data, 1)[0])
+        elif ctrl in (self.CONTROL_POSITION, self.CONTROL_POSITION_RELATIVE):
+            (position,) = struct.unpack_from('<l', data, 1)
+            if len(data) == 13:
+                (speed_limit, _) = struct.unpack_from('<ff', data, 5)
+            elif len(data) == 10 and data[5] == 1:
+                (speed_limit,) = struct.unpack_from('<f', data, 6)
+            else:
+                speed_limit = self.max_speed
+            if ctrl == self.CONTROL_POSITION_RELATIVE:
+                position += self.position
+            self.set_position(position, speed_limit)
+
+    def set_power(self, power):
+        self._target_position = None
+        self._target_speed = self.max_speed * power / 100
+
+    def set_speed(self, speed):
+        self._target_position = None
+        self._target_speed = max(-self.max_speed, min(self.max_speed, speed))
+
+    def set_position(self, position, speed_limit):
+        self._target_position = position
+        self._speed_limit = min(abs(speed_limit) or self.max_speed, self.max_speed)
+
+    def update(self, dt):
+        if self._target_position is not None:
+            remaining = self._target_position - self.position
+            step = self._speed_limit * dt
+            if abs(remaining) <= step:
+                self.position = self._target_position
+                self.speed = 0.0
+            else:
+                self.speed = self._speed_limit if remaining > 0 else -self._speed_limit
+                self.position += self.speed * dt
+        else:
+            self.speed = self._target_speed
+            self.position += self.speed * dt
+
+        self.power = int(max(-100, min(100, 100 * self.speed / self.max_speed)))
+
+    @property
+    def position_reached(self):
+        return self._target_position is not None and self.position == self._target_position
+
+    def status(self):
+        data = struct.pack('<lfb', int(self.position), self.speed, self.power)
+        if self._target_position is not None:
+            data += bytes([self.position_reached])
+        return data
+
+
+class McuEmulator(RevvyTransportInterface):
+    """Software model of the MCU side of the RevvyTransport protocol
+
+    Speaks the same framing as the real firmware (CRC7 protected headers, CRC16 protected payloads, Busy and
+    Pending states) and implements the application commands, including the status updater slots, port types,
+    ring LED and error memory. Meant to run RevvyTransport/RevvyControl based code without a robot.
+
+    command_latency maps command ids to execution times in seconds: these commands respond with "pending" until
+    the time elapses. busy_reads is the number of "busy" responses after each write. transfer_time is the time
+    spent on the bus per transferred byte (~0.1ms at 100kHz I2C)."""
+
+    hardware_version = '2.0.0'
+    firmware_version = '0.2.863'
+    motor_port_count = 6
+    sensor_port_count = 4
+    ring_led_count = 12
+    error_record_length = 63
+
+    motor_port_types = {'NotConfigured': 0, 'DcMotor': 1}
+    sensor_port_types = {'NotConfigured': 0, 'HC_SR04': 1, 'BumperSwitch': 2}
+    ring_led_scenarios = {'Off': 0, 'UserFrame': 1, 'ColorWheel': 2, 'ColorFade': 3, 'BusyIndicator': 4,
+                          'BreathingGreen': 5}
+
+    status_slot_count = 32
+    battery_slot = 10
+    axl_slot = 11
+    gyro_slot = 12
+    yaw_slot = 13
+
+    def __init__(self, command_latency=None, busy_reads=0, transfer_time=0.0, faults: FaultInjection = None):
+        self._command_latency = command_latency or {}
+        self._busy_reads = busy_reads
+        self._transfer_time = transfer_time
+        self._faults = faults or FaultInjection()
+
+        self._handlers = {
+            0x00: lambda payload: b'',
+            0x01: lambda payload: self.hardware_version.encode('utf-8'),
+            0x02: lambda payload: self.firmware_version.encode('utf-8'),
+            0x04: self._set_master_status,
+            0x05: self._set_bluetooth_status,
+            0x06: lambda payload: bytes([0xAA]),
+            0x0B: lambda payload: b'',
+
+            0x10: lambda payload: bytes([self.motor_port_count]),
+            0x11: lambda payload: _encode_string_list(self.motor_port_types),
+            0x12: self._set_motor_port_type,
+            0x13: self._set_motor_port_config,
+            0x14: self._set_motor_port_control,
+            0x15: self._read_motor_port_status,
+
+            0x1A: self._configure_drivetrain,
+            0x1B: self._drivetrain_request,
+
+            0x20: lambda payload: bytes([self.sensor_port_count]),
+            0x21: lambda payload: _encode_string_list(self.sensor_port_types),
+            0x22: self._set_sensor_port_type,
+            0x23: self._set_sensor_port_config,
+            0x24: self._read_sensor_port_status,
+
+            0x30: lambda payload: _encode_string_list(self.ring_led_scenarios),
+            0x31: self._set_ring_led_scenario,
+            0x32: lambda payload: bytes([self.ring_led_count]),
+            0x33: self._set_ring_led_user_frame,
+
+            0x3A: self._status_updater_reset,
+            0x3B: self._status_updater_control,
+            0x3C: self._status_updater_read,
+
+            0x3D: lambda payload: len(self.error_memory).to_bytes(4, byteorder='little'),
+            0x3E: self._read_errors,
+            0x3F: self._clear_errors,
+            0x40: self._record_test_error,
+        }
+
+        self._lock = Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self.master_status = 0
+        self.bluetooth_status = 0
+        self.motors = [_EmulatedMotor() for _ in range(self.motor_port_count)]
+        self.drivetrain = [0] * self.motor_port_count
+        self.sensor_types = [0] * self.sensor_port_count
+        self.sensor_configs = [b''] * self.sensor_port_count
+        self.sensor_values = {1: (100).to_bytes(4, byteorder='little'), 2: bytes([0, 0])}
+        self.ring_led_scenario = 5
+        self.ring_led_frame = b''
+        self.enabled_slots = [False] * self.status_slot_count
+        self.battery = bytes([1, 100, 0, 100])
+        self.acceleration = (0, 0, 1000)
+        self.rotation = (0, 0, 0)
+        self.yaw = (0, 0)
+        self.error_memory = []
+
+        self.commands_received = 0
+        self.bytes_transferred = 0
+
+        self._last_update = time.monotonic()
+        self._response = b''
+        self._busy_remaining = 0
+        self._pending = {}  # command -> (ready time, response)
+
+    def reset(self):
+        """Emulate an MCU reset: every setting returns to its default value"""
+        with self._lock:
+            self._reset_state()
+
+    # RevvyTransportInterface
+    def write(self, data):
+        data = bytes(data)
+        self._transfer(len(data))
+        with self._lock:
+            self.commands_received += 1
+            self._busy_remaining = self._busy_reads
+            self._response = self._handle_frame(data)
+
+    def read(self, length):
+        self._transfer(length)
+        with self._lock:
+            if self._busy_remaining > 0 or self._faults.happens(self._faults.busy):
+                self._busy_remaining = max(0, self._busy_remaining - 1)
+                response = self._encode_response(ResponseHeader.Status_Busy)
+            else:
+                response = self._response
+
+            if self._faults.happens(self._faults.header_corruption):
+                response = bytes([response[0] ^ 0x40]) + response[1:]
+            elif len(response) > ResponseHeader.length and self._faults.happens(self._faults.payload_corruption):
+                response = response[:-1] + bytes([response[-1] ^ 0xFF])
+
+        if len(response) < length:
+            response += bytes(length - len(response))
+        return response[0:length]
+
+    def _transfer(self, length):
+        self.bytes_transferred += length
+        if self._transfer_time:
+            time.sleep(self._transfer_time * length)
+
+    # framing
+    @staticmethod
+    def _encode_response(status, payload=b''):
+        header = bytes([status, len(payload)]) + binascii.crc_hqx(payload, 0xFFFF).to_bytes(2, byteorder='little')
+        return header + bytes([crc7(header)]) + payload
+
+    def _handle_frame(self, frame):
+        if len(frame) < HEADER_LENGTH or crc7(frame[0:HEADER_LENGTH - 1]) != frame[HEADER_LENGTH - 1] \
+                or self._faults.happens(self._faults.command_integrity_error):
+            return self._encode_response(ResponseHeader.Status_Error_CommandIntegrityError)
+
+        (op, command, payload_length, payload_checksum) = struct.unpack_from('<BBBH', frame)
+        payload = frame[HEADER_LENGTH:]
+        if len(payload) != payload_length:
+            return self._encode_response(ResponseHeader.Status_Error_PayloadLengthError)
+        if binascii.crc_hqx(payload, 0xFFFF) != payload_checksum:
+            return self._encode_response(ResponseHeader.Status_Error_PayloadIntegrityError)
+
+        if command not in self._handlers:
+            return self._encode_response(ResponseHeader.Status_Error_UnknownCommand)
+
+        if op == Command.OpStart:
+            response = self._execute(command, payload)
+            latency = self._command_latency.get(command, 0)
+            if latency > 0:
+                self._pending[command] = (time.monotonic() + latency, response)
+                return self._encode_response(ResponseHeader.Status_Pending)
+            return response
+
+        elif op == Command.OpGetResult:
+            if command not in self._pending:
+                return self._encode_response(ResponseHeader.Status_Error_InvalidOperation)
+            (ready_at, response) = self._pending[command]
+            if time.monotonic() < ready_at:
+                return self._encode_response(ResponseHeader.Status_Pending)
+            del self._pending[command]
+            return response
+
+        elif op == Command.OpCancel:
+            self._pending.pop(command, None)
+            return self._encode_response(ResponseHeader.Status_Ok)
+
+        else:
+            return self._encode_response(ResponseHeader.Status_Error_UnknownOperation)
+
+    def _execute(self, command, payload):
+        self._update_motors()
+        try:
+            result = self._handlers[command](payload)
+        except (IndexError, ValueError, struct.error):
+            return self._encode_response(ResponseHeader.Status_Error_CommandError)
+
+        if result is None:
+            return self._encode_response(ResponseHeader.Status_Error_CommandError)
+        return self._encode_response(ResponseHeader.Status_Ok, result)
+
+    def _update_motors(self):
+        now = time.monotonic()
+        dt = now - self._last_update
+        self._last_update = now
+        for motor in self.motors:
+            motor.update(dt)
+
+    @staticmethod
+    def _port_index(port, port_count):
+        # port commands use the 1-based port numbers of the framework, status slots and the drivetrain are 0-based
+        if not 1 <= port <= port_count:
+            raise IndexError
+        return port - 1
+
+    # command handlers, return the response payload or None on error
+    def _set_master_status(self, payload):
+        self.master_status = payload[0]
+        return b''
+
+    def _set_bluetooth_status(self, payload):
+        self.bluetooth_status = payload[0]
+        return b''
+
+    def _set_motor_port_type(self, payload):
+        (port, port_type) = payload
+        if port_type not in self.motor_port_types.values():
+            return None
+        motor = _EmulatedMotor()
+        motor.port_type = port_type
+        self.motors[self._port_index(port, self.motor_port_count)] = motor
+        return b''
+
+    def _set_motor_port_config(self, payload):
+        self.motors[self._port_index(payload[0], self.motor_port_count)].config = payload[1:]
+        return b''
+
+    def _set_motor_port_control(self, payload):
+        motor = self.motors[self._port_index(payload[0], self.motor_port_count)]
+        if motor.port_type == 0:
+            return None
+        motor.control(payload[1:])
+        return b''
+
+    def _read_motor_port_status(self, payload):
+        motor = self.motors[self._port_index(payload[0], self.motor_port_count)]
+        return motor.status() if motor.port_type != 0 else b''
+
+    def _configure_drivetrain(self, payload):
+        if len(payload) != 1 + self.motor_port_count:
+            return None
+        self.drivetrain = list(payload[1:])
+        return b''
+
+    def _drivetrain_request(self, payload):
+        request_type = payload[0]
+        sides = {1: 0, 2: 1}
+        if request_type == 1:
+            (_, left, right, _) = struct.unpack('<bffb', payload)
+            speeds = (left, right)
+            for idx, side in enumerate(self.drivetrain):
+                if side in sides:
+                    self.motors[idx].set_speed(speeds[sides[side]])
+        elif request_type == 0:
+            (_, left, right, left_speed, right_speed, _) = struct.unpack('<bllffb', payload)
+            targets = ((left, left_speed), (right, right_speed))
+            for idx, side in enumerate(self.drivetrain):
+                if side in sides:
+                    motor = self.motors[idx]
+                    (target, speed) = targets[sides[side]]
+                    motor.set_position(motor.position + target, speed)
+        elif request_type != 3:
+            return None
+        return b''
+
+    def _set_sensor_port_type(self, payload):
+        (port, port_type) = payload
+        if port_type not in self.sensor_port_types.values():
+            return None
+        self.sensor_types[self._port_index(port, self.sensor_port_count)] = port_type
+        return b''
+
+    def _set_sensor_port_config(self, payload):
+        self.sensor_configs[self._port_index(payload[0], self.sensor_port_count)] = payload[1:]
+        return b''
+
+    def _read_sensor_port_status(self, payload):
+        return self.sensor_values.get(self.sensor_types[self._port_index(payload[0], self.sensor_port_count)], b'')
+
+    def _set_ring_led_scenario(self, payload):
+        if payload[0] not in self.ring_led_scenarios.values():
+            return None
+        self.ring_led_scenario = payload[0]
+        return b''
+
+    def _set_ring_led_user_frame(self, payload):
+        if len(payload) != 2 * self.ring_led_count:
+            return None
+        self.ring_led_frame = payload
+        return b''
+
+    def _status_updater_reset(self, payload):
+        self.enabled_slots = [False] * self.status_slot_count
+        return b''
+
+    def _status_updater_control(self, payload):
+        (slot, enabled) = payload
+        self.enabled_slots[slot] = bool(enabled)
+        return b''
+
+    def _slot_data(self, slot):
+        if slot < self.motor_port_count:
+            return self._read_motor_port_status([slot + 1])
+        elif slot < self.motor_port_count + self.sensor_port_count:
+            return self._read_sensor_port_status([slot - self.motor_port_count + 1])
+        elif slot == self.battery_slot:
+            return self.battery
+        elif slot == self.axl_slot:
+            return struct.pack('<hhh', *(int(v / 0.061) for v in self.acceleration))
+        elif slot == self.gyro_slot:
+            return struct.pack('<hhh', *(int(v / 0.035) for v in self.rotation))
+        elif slot == self.yaw_slot:
+            return struct.pack('<ll', *self.yaw)
+        return b''
+
+    def _status_updater_read(self, payload):
+        data = bytearray()
+        for slot, enabled in enumerate(self.enabled_slots):
+            if enabled:
+                slot_data = self._slot_data(slot)
+                data += bytes([slot, len(slot_data)]) + slot_data
+        return bytes(data)
+
+    def _read_errors(self, payload):
+        start_idx = int.from_bytes(payload, byteorder='little')
+        records_per_response = 255 // self.error_record_length
+        return b''.join(self.error_memory[start_idx:start_idx + records_per_response])
+
+    def _clear_errors(self, payload):
+        self.error_memory.clear()
+        return b''
+
+    def record_error(self, error_id, data=b''):
+        """Add an entry to the error memory, using the layout of the firmware's error records"""
+        hw = self._version_to_int(self.hardware_version)
+        fw = self._version_to_int(self.firmware_version)
+        record = struct.pack('<BLL', error_id, hw, fw) + bytes(data)
+        record = record[0:self.error_record_length]
+        self.error_memory.append(record + bytes(self.error_record_length - len(record)))
+
+    @staticmethod
+    def _version_to_int(version):
+        (major, minor, revision) = (int(part) for part in version.split('.'))
+        return major << 24 | minor << 16 | revision
+
+    def _record_test_error(self, payload):
+        self.record_error(0x0A, b'test error')
+        return b''
+
+
+class RevvyTransportEmulator:
+    """Drop-in replacement of RevvyTransportI2C that connects to emulated MCUs
+
+    >>> from revvy.mcu.rrrc_control import RevvyControl
+    >>> with RevvyTransportEmulator() as transport:
+    ...     robot_control = RevvyControl(transport.bind(0x2D))
+    ...     robot_control.get_motor_port_amount()
+    6
+    """
+
+    def __init__(self, **emulator_args):
+        self._emulator_args = emulator_args
+        self._devices = {}
+        self._bus = BusManager(self.device)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def device(self, address) -> McuEmulator:
+        if address not in self._devices:
+            self._devices[address] = McuEmulator(**self._emulator_args)
+        return self._devices[address]
+
+    def bind(self, address):
+        return self._bus.bind(address)
+
+    @property
+    def device_statistics(self):
+        return self._bus.device_statistics
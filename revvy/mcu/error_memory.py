@@ -0,0 +1,193 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Reading the MCU error memory, and keeping a local copy of it
+
+The error memory is read a page (the records that fit into one response) at a time. The error memory commands are
+Bulk priority transactions, so motor control and status reads are served between the pages.
+
+>>> import tempfile
+>>> from revvy.mcu.emulator import McuEmulator
+>>> from revvy.mcu.rrrc_transport import RevvyTransport
+>>> mcu = McuEmulator()
+>>> control = RevvyControl(RevvyTransport(mcu))
+>>> for _ in range(5):
+...     control.error_memory_test()
+>>> log = ErrorMemoryLog(os.path.join(tempfile.mkdtemp(), 'errors.bin'))
+>>> len(list(log.sync(control)))
+5
+>>> control.error_memory_test()
+>>> [record.index for record in log.sync(control)]
+[5]
+>>> control.error_memory_clear()
+>>> control.error_memory_test()
+>>> [record.index for record in log.sync(control)]
+[6]
+>>> log.count
+7
+"""
+
+import os
+import struct
+from collections import namedtuple
+from threading import Lock
+
+from revvy.mcu.rrrc_control import RevvyControl
+from revvy.thread_wrapper import ThreadWrapper, ThreadContext
+from revvy.version import Version
+
+ErrorRecord = namedtuple('ErrorRecord', ['index', 'error_id', 'hw_version', 'fw_version', 'data'])
+
+record_length = 63
+_record_header = struct.Struct('<BLL')  # error id, hardware version, firmware version
+
+
+def _decode_version(value):
+    return Version('{}.{}.{}'.format(value >> 24, (value >> 16) & 0xFF, value & 0xFFFF))
+
+
+def decode_error_record(index, raw):
+    """
+    >>> record = decode_error_record(3, bytes.fromhex('0a000000025f030200') + b'test error' + bytes(44))
+    >>> record.error_id, record.hw_version, record.fw_version, record.data[0:10]
+    (10, Version(2.0.0), Version(0.2.863), b'test error')
+    """
+    (error_id, hw, fw) = _record_header.unpack_from(raw)
+    return ErrorRecord(index, error_id, _decode_version(hw), _decode_version(fw), bytes(raw[_record_header.size:]))
+
+
+def _read_raw_records(interface: RevvyControl, start_idx, count):
+    idx = start_idx
+    while idx < count:
+        page = interface.error_memory_read_errors(idx)
+        if not page:
+            return
+
+        for raw in page:
+            if len(raw) != record_length or idx >= count:
+                return
+            yield idx, raw
+            idx += 1
+
+
+def read_error_records(interface: RevvyControl, start_idx=0):
+    """Yield the decoded records of the error memory, starting at start_idx
+
+    The number of records is read when the generator is started, records that are added later are not returned."""
+    count = interface.error_memory_read_count()
+    for idx, raw in _read_raw_records(interface, start_idx, count):
+        yield decode_error_record(idx, raw)
+
+
+class ErrorMemoryLog:
+    """Local copy of the MCU error memory, kept in a file that only grows
+
+    The file contains a header and the raw records. A sync only reads the records that were added since the previous
+    one. Records that were cleared from the MCU are kept: the header stores the local index of the first record that
+    is (or was, at the last sync) in the MCU memory. Clearing is detected by the record count going down, or the last
+    synced record not matching the one on the MCU."""
+
+    _header = struct.Struct('<4sHL')  # magic, version, local index of the first record in the MCU memory
+    _magic = b'RVEM'
+    _version = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = Lock()
+        self._mcu_base = 0
+        self._count = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self._path, 'rb') as f:
+                header = f.read(self._header.size)
+            size = os.path.getsize(self._path)
+        except FileNotFoundError:
+            header = b''
+            size = 0
+
+        if len(header) == self._header.size:
+            (magic, version, mcu_base) = self._header.unpack(header)
+            if magic == self._magic and version == self._version:
+                self._count = (size - self._header.size) // record_length
+                self._mcu_base = min(mcu_base, self._count)
+
+                # drop a record that was partially written when the previous sync was interrupted
+                os.truncate(self._path, self._header.size + self._count * record_length)
+                return
+
+            print('ErrorMemoryLog: {} is not an error memory log, starting a new one'.format(self._path))
+
+        with open(self._path, 'wb') as f:
+            f.write(self._header.pack(self._magic, self._version, 0))
+
+    def _write_header(self):
+        with open(self._path, 'r+b') as f:
+            f.write(self._header.pack(self._magic, self._version, self._mcu_base))
+
+    def _read_raw(self, start, count):
+        with open(self._path, 'rb') as f:
+            f.seek(self._header.size + start * record_length)
+            return f.read(count * record_length)
+
+    @property
+    def count(self):
+        """Number of stored records"""
+        return self._count
+
+    def records(self, start=0):
+        """Yield the stored records, starting at the given local index"""
+        chunk = 64
+        for first in range(start, self._count, chunk):
+            data = self._read_raw(first, min(chunk, self._count - first))
+            for i in range(len(data) // record_length):
+                yield decode_error_record(first + i, data[i * record_length:(i + 1) * record_length])
+
+    def _mcu_was_cleared(self, interface: RevvyControl, mcu_count, synced):
+        if mcu_count < synced:
+            return True
+        if synced == 0:
+            return False
+
+        page = interface.error_memory_read_errors(synced - 1)
+        return not page or bytes(page[0]) != self._read_raw(self._count - 1, 1)
+
+    def sync(self, interface: RevvyControl):
+        """Read the new records from the MCU, store and yield them as they arrive
+
+        Stopping the iteration early is safe, the next sync continues from the last stored record."""
+        with self._lock:
+            mcu_count = interface.error_memory_read_count()
+            synced = self._count - self._mcu_base
+
+            if self._mcu_was_cleared(interface, mcu_count, synced):
+                self._mcu_base = self._count
+                self._write_header()
+                synced = 0
+
+            with open(self._path, 'ab') as f:
+                for _, raw in _read_raw_records(interface, synced, mcu_count):
+                    f.write(raw)
+                    f.flush()
+                    self._count += 1
+                    yield decode_error_record(self._count - 1, raw)
+
+
+def create_error_memory_sync_thread(log: ErrorMemoryLog, interface: RevvyControl):
+    """A thread that brings the log up to date once per start"""
+
+    def _sync(ctx: ThreadContext):
+        new_records = 0
+        for _ in log.sync(interface):
+            new_records += 1
+            if ctx.stop_requested:
+                break
+
+        print('ErrorMemoryLog: {} new record(s), {} stored'.format(new_records, log.count))
+
+    return ThreadWrapper(_sync, "ErrorMemorySyncThread")
@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import binascii
+
+CRC7_TABLE = (
+    0x00, 0x09, 0x12, 0x1b, 0x24, 0x2d, 0x36, 0x3f,
+    0x48, 0x41, 0x5a, 0x53, 0x6c, 0x65, 0x7e, 0x77,
+    0x19, 0x10, 0x0b, 0x02, 0x3d, 0x34, 0x2f, 0x26,
+    0x51, 0x58, 0x43, 0x4a, 0x75, 0x7c, 0x67, 0x6e,
+    0x32, 0x3b, 0x20, 0x29, 0x16, 0x1f, 0x04, 0x0d,
+    0x7a, 0x73, 0x68, 0x61, 0x5e, 0x57, 0x4c, 0x45,
+    0x2b, 0x22, 0x39, 0x30, 0x0f, 0x06, 0x1d, 0x14,
+    0x63, 0x6a, 0x71, 0x78, 0x47, 0x4e, 0x55, 0x5c,
+    0x64, 0x6d, 0x76, 0x7f, 0x40, 0x49, 0x52, 0x5b,
+    0x2c, 0x25, 0x3e, 0x37, 0x08, 0x01, 0x1a, 0x13,
+    0x7d, 0x74, 0x6f, 0x66, 0x59, 0x50, 0x4b, 0x42,
+    0x35, 0x3c, 0x27, 0x2e, 0x11, 0x18, 0x03, 0x0a,
+    0x56, 0x5f, 0x44, 0x4d, 0x72, 0x7b, 0x60, 0x69,
+    0x1e, 0x17, 0x0c, 0x05, 0x3a, 0x33, 0x28, 0x21,
+    0x4f, 0x46, 0x5d, 0x54, 0x6b, 0x62, 0x79, 0x70,
+    0x07, 0x0e, 0x15, 0x1c, 0x23, 0x2a, 0x31, 0x38,
+    0x41, 0x48, 0x53, 0x5a, 0x65, 0x6c, 0x77, 0x7e,
+    0x09, 0x00, 0x1b, 0x12, 0x2d, 0x24, 0x3f, 0x36,
+    0x58, 0x51, 0x4a, 0x43, 0x7c, 0x75, 0x6e, 0x67,
+    0x10, 0x19, 0x02, 0x0b, 0x34, 0x3d, 0x26, 0x2f,
+    0x73, 0x7a, 0x61, 0x68, 0x57, 0x5e, 0x45, 0x4c,
+    0x3b, 0x32, 0x29, 0x20, 0x1f, 0x16, 0x0d, 0x04,
+    0x6a, 0x63, 0x78, 0x71, 0x4e, 0x47, 0x5c, 0x55,
+    0x22, 0x2b, 0x30, 0x39, 0x06, 0x0f, 0x14, 0x1d,
+    0x25, 0x2c, 0x37, 0x3e, 0x01, 0x08, 0x13, 0x1a,
+    0x6d, 0x64, 0x7f, 0x76, 0x49, 0x40, 0x5b, 0x52,
+    0x3c, 0x35, 0x2e, 0x27, 0x18, 0x11, 0x0a, 0x03,
+    0x74, 0x7d, 0x66, 0x6f, 0x50, 0x59, 0x42, 0x4b,
+    0x17, 0x1e, 0x05, 0x0c, 0x33, 0x3a, 0x21, 0x28,
+    0x5f, 0x56, 0x4d, 0x44, 0x7b, 0x72, 0x69, 0x60,
+    0x0e, 0x07, 0x1c, 0x15, 0x2a, 0x23, 0x38, 0x31,
+    0x46, 0x4f, 0x54, 0x5d, 0x62, 0x6b, 0x70, 0x79)
+
+HEADER_LENGTH = 6
+MAX_PAYLOAD_LENGTH = 255
+
+# checksum of an empty payload, used by every zero-payload frame
+EMPTY_PAYLOAD_CHECKSUM = binascii.crc_hqx(b'', 0xFFFF)
+
+
+def crc7(data, crc=0xFF):
+    """
+    >>> crc7(b'')
+    255
+    >>> crc7(bytes([0, 0, 0, 0xFF, 0xFF]))
+    87
+    """
+    table = CRC7_TABLE
+    for b in data:
+        crc = table[(b ^ (crc << 1) & 0xFF)]
+    return crc
+
+
+_header_templates = {}
+_empty_frames = {}
+
+
+def header_template(op, command, payload_length):
+    """Return the constant part of a frame header and the CRC7 state after it
+
+    The first 3 header bytes only depend on (op, command, payload_length) so they, and the partial CRC7 calculated
+    over them, are computed once and reused for every frame with the same shape.
+
+    >>> header_template(0, 0x3C, 0)
+    (b'\\x00<\\x00', 115)
+    """
+    key = (op, command, payload_length)
+    try:
+        return _header_templates[key]
+    except KeyError:
+        prefix = bytes(key)
+        template = (prefix, crc7(prefix))
+        _header_templates[key] = template
+        return template
+
+
+def _finish_header_crc(crc, checksum):
+    crc = CRC7_TABLE[((checksum & 0xFF) ^ (crc << 1) & 0xFF)]
+    return CRC7_TABLE[((checksum >> 8) ^ (crc << 1) & 0xFF)]
+
+
+def empty_frame(op, command):
+    """Return the complete, cached frame of a command that has no payload
+
+    >>> empty_frame(2, 0x3C) == encode_frame(2, 0x3C, b'')
+    True
+    """
+    key = (op, command)
+    try:
+        return _empty_frames[key]
+    except KeyError:
+        prefix, crc = header_template(op, command, 0)
+        frame = prefix + EMPTY_PAYLOAD_CHECKSUM.to_bytes(2, byteorder='little') \
+            + bytes([_finish_header_crc(crc, EMPTY_PAYLOAD_CHECKSUM)])
+        _empty_frames[key] = frame
+        return frame
+
+
+def encode_frame(op, command, payload=b''):
+    """Encode a complete frame into a new bytes object
+
+    >>> encode_frame(0, 0x04, b'\\x01')
+    b'\\x00\\x04\\x01\\xd1\\xf1\\x1a\\x01'
+    """
+    payload_length = len(payload)
+    if payload_length == 0:
+        return empty_frame(op, command)
+
+    if payload_length > MAX_PAYLOAD_LENGTH:
+        raise ValueError('Payload is too long ({} bytes, {} allowed)'.format(payload_length, MAX_PAYLOAD_LENGTH))
+
+    prefix, crc = header_template(op, command, payload_length)
+    checksum = binascii.crc_hqx(payload, 0xFFFF)
+    return prefix + checksum.to_bytes(2, byteorder='little') + bytes([_finish_header_crc(crc, checksum)]) + payload
+
+
+class FrameWriter:
+    """Builds frames into a preallocated buffer
+
+    The returned memoryview points into the internal buffer and is only valid until the next call to write().
+    Frames without payload are returned from the cache, without touching the buffer.
+
+    >>> writer = FrameWriter()
+    >>> bytes(writer.write(0, 0x04, b'\\x01')) == encode_frame(0, 0x04, b'\\x01')
+    True
+    >>> bytes(writer.write(2, 0x04)) == encode_frame(2, 0x04)
+    True
+    """
+
+    def __init__(self):
+        self._buffer = bytearray(HEADER_LENGTH + MAX_PAYLOAD_LENGTH)
+        self._view = memoryview(self._buffer)
+
+    def write(self, op, command, payload=b''):
+        payload_length = len(payload)
+        if payload_length == 0:
+            return empty_frame(op, command)
+
+        if payload_length > MAX_PAYLOAD_LENGTH:
+            raise ValueError('Payload is too long ({} bytes, {} allowed)'.format(payload_length, MAX_PAYLOAD_LENGTH))
+
+        prefix, crc = header_template(op, command, payload_length)
+        checksum = binascii.crc_hqx(payload, 0xFFFF)
+
+        buffer = self._buffer
+        frame_length = HEADER_LENGTH + payload_length
+        buffer[0:3] = prefix
+        buffer[3] = checksum & 0xFF
+        buffer[4] = checksum >> 8
+        buffer[5] = _finish_header_crc(crc, checksum)
+        buffer[HEADER_LENGTH:frame_length] = payload
+
+        return self._view[0:frame_length]
@@ -1,7 +1,17 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
 from revvy.mcu.commands import *
+from revvy.mcu.config_journal import ConfigJournal
 from revvy.mcu.rrrc_transport import RevvyTransport
+from revvy.mcu.setpoint_outbox import SetpointOutbox
+from revvy.mcu.state_cache import StateCache
+
+
+def _declare_command_profiles(transport, control):
+    for command in vars(control).values():
+        if isinstance(command, Command):
+            transport.declare_command_profile(command.command_id, command.expected_latency,
+                                              command.max_response_length, command.priority)
 
 
 class BootloaderControl:
@@ -12,46 +22,165 @@ class BootloaderControl:
         self.send_firmware = SendFirmwareCommand(transport)
         self.finalize_update = FinalizeUpdateCommand(transport)
 
+        _declare_command_profiles(transport, self)
+
 
 class RevvyControl:
     def __init__(self, transport: RevvyTransport):
+        self._transport = transport
+
+        # motor and drivetrain setpoints may be issued faster than the bus can carry them, only the latest is sent
+        self.setpoints = SetpointOutbox(transport)
+
+        # the configuration is recorded so that it can be restored quickly if the MCU resets
+        self.config_journal = ConfigJournal(transport)
+
+        # state setters are skipped when they would not change anything
+        self.state_cache = StateCache(self.config_journal)
+
         self.ping = PingCommand(transport)
 
-        self.set_master_status = SetMasterStatusCommand(transport)
+        self.set_master_status = SetMasterStatusCommand(self.state_cache)
         self.read_operation_mode = ReadOperationModeCommand(transport)
-        self.set_bluetooth_connection_status = SetBluetoothStatusCommand(transport)
+        self.set_bluetooth_connection_status = SetBluetoothStatusCommand(self.state_cache)
         self.get_hardware_version = ReadHardwareVersionCommand(transport)
         self.get_firmware_version = ReadFirmwareVersionCommand(transport)
         self.reboot_bootloader = RebootToBootloaderCommand(transport)
 
         self.get_motor_port_amount = ReadMotorPortAmountCommand(transport)
         self.get_motor_port_types = ReadMotorPortTypesCommand(transport)
-        self.set_motor_port_type = SetMotorPortTypeCommand(transport)
-        self.set_motor_port_config = SetMotorPortConfigCommand(transport)
-        self.set_motor_port_control_value = SetMotorPortControlCommand(transport)
+        self.set_motor_port_type = SetMotorPortTypeCommand(self.state_cache)
+        self.set_motor_port_config = SetMotorPortConfigCommand(self.config_journal)
+        self.set_motor_port_control_value = SetMotorPortControlCommand(self.setpoints)
         self.get_motor_position = ReadMotorPortStatusCommand(transport)
 
-        self.configure_drivetrain = ConfigureDrivetrain(transport)
-        self.set_drivetrain_position = RequestDifferentialDriveTrainPositionCommand(transport)
-        self.set_drivetrain_speed = RequestDifferentialDriveTrainSpeedCommand(transport)
-        self.drivetrain_turn = RequestDifferentialDriveTrainTurnCommand(transport)
+        self.setpoints.key_by_port(self.set_motor_port_control_value.command_id)
+        self.state_cache.key_by_port(self.set_motor_port_type.command_id)
+        self.config_journal.key_by_port(self.set_motor_port_type.command_id)
+        self.config_journal.key_by_port(self.set_motor_port_config.command_id)
+        self.config_journal.clears(self.set_motor_port_type.command_id, self.set_motor_port_config.command_id)
+
+        self.configure_drivetrain = ConfigureDrivetrain(self.state_cache)
+        self.set_drivetrain_position = RequestDifferentialDriveTrainPositionCommand(self.setpoints)
+        self.set_drivetrain_speed = RequestDifferentialDriveTrainSpeedCommand(self.setpoints)
+        self.drivetrain_turn = RequestDifferentialDriveTrainTurnCommand(self.setpoints)
 
         self.get_sensor_port_amount = ReadSensorPortAmountCommand(transport)
         self.get_sensor_port_types = ReadSensorPortTypesCommand(transport)
-        self.set_sensor_port_type = SetSensorPortTypeCommand(transport)
-        self.set_sensor_port_config = SetSensorPortConfigCommand(transport)
+        self.set_sensor_port_type = SetSensorPortTypeCommand(self.state_cache)
+        self.set_sensor_port_config = SetSensorPortConfigCommand(self.config_journal)
         self.get_sensor_port_value = ReadSensorPortStatusCommand(transport)
 
+        self.state_cache.key_by_port(self.set_sensor_port_type.command_id)
+        self.config_journal.key_by_port(self.set_sensor_port_type.command_id)
+        self.config_journal.key_by_port(self.set_sensor_port_config.command_id)
+        self.config_journal.clears(self.set_sensor_port_type.command_id, self.set_sensor_port_config.command_id)
+
         self.ring_led_get_scenario_types = ReadRingLedScenarioTypesCommand(transport)
         self.ring_led_get_led_amount = GetRingLedAmountCommand(transport)
-        self.ring_led_set_scenario = SetRingLedScenarioCommand(transport)
-        self.ring_led_set_user_frame = SendRingLedUserFrameCommand(transport)
+        self.ring_led_set_scenario = SetRingLedScenarioCommand(self.state_cache)
+        self.ring_led_set_user_frame = SendRingLedUserFrameCommand(self.state_cache)
 
-        self.status_updater_reset = McuStatusUpdater_ResetCommand(transport)
-        self.status_updater_control = McuStatusUpdater_ControlCommand(transport)
+        self.status_updater_reset = McuStatusUpdater_ResetCommand(self.config_journal)
+        self.status_updater_control = McuStatusUpdater_ControlCommand(self.config_journal)
         self.status_updater_read = McuStatusUpdater_ReadCommand(transport)
 
         self.error_memory_read_count = ErrorMemory_ReadCount(transport)
         self.error_memory_read_errors = ErrorMemory_ReadErrors(transport)
         self.error_memory_clear = ErrorMemory_Clear(transport)
         self.error_memory_test = ErrorMemory_TestError(transport)
+
+        self.config_journal.track(*(command.command_id for command in (
+            self.set_master_status, self.set_bluetooth_connection_status,
+            self.set_motor_port_type, self.set_motor_port_config, self.configure_drivetrain,
+            self.set_sensor_port_type, self.set_sensor_port_config,
+            self.ring_led_set_scenario, self.ring_led_set_user_frame,
+            self.status_updater_reset, self.status_updater_control)))
+        self.config_journal.key_by_port(self.status_updater_control.command_id)
+        self.config_journal.clears(self.status_updater_reset.command_id, self.status_updater_control.command_id)
+        # ports need their type before their configuration, the drivetrain and the status slots need configured ports
+        self.config_journal.replay_order(*(command.command_id for command in (
+            self.set_motor_port_type, self.set_sensor_port_type,
+            self.set_motor_port_config, self.set_sensor_port_config,
+            self.configure_drivetrain,
+            self.status_updater_reset, self.status_updater_control,
+            self.ring_led_set_scenario, self.ring_led_set_user_frame,
+            self.set_master_status, self.set_bluetooth_connection_status)))
+
+        _declare_command_profiles(transport, self)
+
+    @property
+    def transport_metrics(self):
+        """Performance metrics of the MCU link, see TransportMetrics.snapshot()"""
+        return self._transport.metrics
+
+    def batch(self):
+        """Collect commands and send them to the MCU in one go, holding the bus only once
+
+        >>> with robot_control.batch() as batch:  # doctest: +SKIP
+        ...     batch.set_motor_port_type(1, 0)
+        ...     batch.set_motor_port_type(2, 0)
+        """
+        return CommandBatch(self._transport, self.state_cache, self.config_journal)
+
+
+class BatchError(Exception):
+    def __init__(self, failed):
+        super().__init__('{} command(s) of the batch failed: {}'.format(
+            len(failed), ', '.join('#{} (command {:X})'.format(idx, command) for idx, command, _ in failed)))
+        self.failed = failed
+
+
+class CommandBatch:
+    """Records the commands called on it and sends them together when the context is exited
+
+    Commands issued inside the batch return None, their responses are available in the responses list after the
+    batch has been sent. If any of the commands fail, BatchError is raised with the (index, command, response)
+    tuples of the failed commands. The batch bypasses the state cache and the configuration journal of the
+    RevvyControl that created it: sending the batch invalidates the cache and records the acknowledged commands in
+    the journal."""
+
+    def __init__(self, transport: RevvyTransport, state_cache: StateCache = None, journal: ConfigJournal = None):
+        self._transport = transport
+        self._state_cache = state_cache
+        self._journal = journal
+        self._requests = []
+        self._responses = []
+        self._control = RevvyControl(self)
+
+    def send_command(self, command, payload=bytes()):
+        self._requests.append((command, payload))
+        return None
+
+    def declare_command_profile(self, command, expected_latency=0.0, max_response_length=0,
+                                priority=Priority.Configuration):
+        self._transport.declare_command_profile(command, expected_latency, max_response_length, priority)
+
+    def __getattr__(self, name):
+        return getattr(self._control, name)
+
+    @property
+    def responses(self):
+        return self._responses
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self._requests:
+            requests = self._requests
+            self._requests = []
+            self._responses = self._transport.send_batch(requests)
+            if self._state_cache is not None:
+                self._state_cache.invalidate()
+
+            if self._journal is not None:
+                for (command, payload), response in zip(requests, self._responses):
+                    if response.error is None and response.status == ResponseHeader.Status_Ok:
+                        self._journal.record(command, payload)
+
+            failed = [(idx, requests[idx][0], response)
+                      for idx, response in enumerate(self._responses)
+                      if response.error is not None or response.status != ResponseHeader.Status_Ok]
+            if failed:
+                raise BatchError(failed)
@@ -2,61 +2,28 @@
 
 import time
 import binascii
-from threading import Lock
+from threading import Event
 
-from revvy.functions import retry
+from revvy.functions import clip
+from revvy.mcu.bus_arbiter import BusArbiter, Priority
+from revvy.mcu.frame_codec import crc7, empty_frame, encode_frame, FrameWriter
+from revvy.mcu.transport_metrics import TransportMetrics
+from revvy.retry_policy import RetryPolicy, ExponentialBackoff, SampledErrorReporter, CircuitBreaker, \
+    CircuitOpenError
 
 
 class TransportException(Exception):
     pass
 
 
-def crc7(data, crc=0xFF):
-    crc7_table = [
-        0x00, 0x09, 0x12, 0x1b, 0x24, 0x2d, 0x36, 0x3f,
-        0x48, 0x41, 0x5a, 0x53, 0x6c, 0x65, 0x7e, 0x77,
-        0x19, 0x10, 0x0b, 0x02, 0x3d, 0x34, 0x2f, 0x26,
-        0x51, 0x58, 0x43, 0x4a, 0x75, 0x7c, 0x67, 0x6e,
-        0x32, 0x3b, 0x20, 0x29, 0x16, 0x1f, 0x04, 0x0d,
-        0x7a, 0x73, 0x68, 0x61, 0x5e, 0x57, 0x4c, 0x45,
-        0x2b, 0x22, 0x39, 0x30, 0x0f, 0x06, 0x1d, 0x14,
-        0x63, 0x6a, 0x71, 0x78, 0x47, 0x4e, 0x55, 0x5c,
-        0x64, 0x6d, 0x76, 0x7f, 0x40, 0x49, 0x52, 0x5b,
-        0x2c, 0x25, 0x3e, 0x37, 0x08, 0x01, 0x1a, 0x13,
-        0x7d, 0x74, 0x6f, 0x66, 0x59, 0x50, 0x4b, 0x42,
-        0x35, 0x3c, 0x27, 0x2e, 0x11, 0x18, 0x03, 0x0a,
-        0x56, 0x5f, 0x44, 0x4d, 0x72, 0x7b, 0x60, 0x69,
-        0x1e, 0x17, 0x0c, 0x05, 0x3a, 0x33, 0x28, 0x21,
-        0x4f, 0x46, 0x5d, 0x54, 0x6b, 0x62, 0x79, 0x70,
-        0x07, 0x0e, 0x15, 0x1c, 0x23, 0x2a, 0x31, 0x38,
-        0x41, 0x48, 0x53, 0x5a, 0x65, 0x6c, 0x77, 0x7e,
-        0x09, 0x00, 0x1b, 0x12, 0x2d, 0x24, 0x3f, 0x36,
-        0x58, 0x51, 0x4a, 0x43, 0x7c, 0x75, 0x6e, 0x67,
-        0x10, 0x19, 0x02, 0x0b, 0x34, 0x3d, 0x26, 0x2f,
-        0x73, 0x7a, 0x61, 0x68, 0x57, 0x5e, 0x45, 0x4c,
-        0x3b, 0x32, 0x29, 0x20, 0x1f, 0x16, 0x0d, 0x04,
-        0x6a, 0x63, 0x78, 0x71, 0x4e, 0x47, 0x5c, 0x55,
-        0x22, 0x2b, 0x30, 0x39, 0x06, 0x0f, 0x14, 0x1d,
-        0x25, 0x2c, 0x37, 0x3e, 0x01, 0x08, 0x13, 0x1a,
-        0x6d, 0x64, 0x7f, 0x76, 0x49, 0x40, 0x5b, 0x52,
-        0x3c, 0x35, 0x2e, 0x27, 0x18, 0x11, 0x0a, 0x03,
-        0x74, 0x7d, 0x66, 0x6f, 0x50, 0x59, 0x42, 0x4b,
-        0x17, 0x1e, 0x05, 0x0c, 0x33, 0x3a, 0x21, 0x28,
-        0x5f, 0x56, 0x4d, 0x44, 0x7b, 0x72, 0x69, 0x60,
-        0x0e, 0x07, 0x1c, 0x15, 0x2a, 0x23, 0x38, 0x31,
-        0x46, 0x4f, 0x54, 0x5d, 0x62, 0x6b, 0x70, 0x79]
-
-    for b in data:
-        crc = crc7_table[(b ^ (crc << 1) & 0xFF)]
-    return crc
-
-
 class RevvyTransportInterface:
     def read(self, length): raise NotImplementedError()
     def write(self, data): raise NotImplementedError()
 
 
 class Command:
+    __slots__ = ('_op', '_command', '_payload')
+
     OpStart = 0
     OpRestart = 1
     OpGetResult = 2
@@ -71,12 +38,7 @@ class Command:
             raise ValueError('Payload is too long ({} bytes, 255 allowed)'.format(len(self._payload)))
 
     def get_bytes(self):
-        header = bytes([self._op, self._command, len(self._payload)])
-        payload_checksum = binascii.crc_hqx(self._payload, 0xFFFF)
-        header += bytes(payload_checksum.to_bytes(2, byteorder='little'))
-        header += bytes([crc7(header, 0xFF)])
-
-        return header + self._payload
+        return encode_frame(self._op, self._command, self._payload)
 
     @classmethod
     def start(cls, command, payload=bytes()):
@@ -92,6 +54,8 @@ class Command:
 
 
 class ResponseHeader:
+    __slots__ = ('_status', '_payload_length', '_payload_checksum', '_header_checksum')
+
     Status_Ok = 0
     Status_Busy = 1
     Status_Pending = 2
@@ -129,10 +93,20 @@ class ResponseHeader:
 
         return False
 
-    def __init__(self, data):
+    def __init__(self, data=None):
+        if data is None:
+            self._status = None
+            self._payload_length = 0
+            self._payload_checksum = 0
+            self._header_checksum = 0
+        else:
+            self.update(data)
+
+    def update(self, data):
+        """Parse a new header into this object"""
         self._status = data[0]
         self._payload_length = data[1]
-        self._payload_checksum = int.from_bytes(data[2:4], byteorder='little')
+        self._payload_checksum = data[2] | (data[3] << 8)
         self._header_checksum = data[4]
 
     def validate_payload(self, payload):
@@ -142,7 +116,7 @@ class ResponseHeader:
         return len(header) >= self.length \
                and self._status == header[0] \
                and self._payload_length == header[1] \
-               and self._payload_checksum == int.from_bytes(header[2:4], byteorder='little') \
+               and self._payload_checksum == header[2] | (header[3] << 8) \
                and self._header_checksum == header[4]
 
     @property
@@ -155,9 +129,12 @@ class ResponseHeader:
 
 
 class Response:
-    def __init__(self, status, payload):
+    __slots__ = ('_status', '_payload', '_error')
+
+    def __init__(self, status, payload, error=None):
         self._status = status
         self._payload = payload
+        self._error = error
 
     @property
     def status(self):
@@ -167,79 +144,362 @@ class Response:
     def payload(self):
         return self._payload
 
+    @property
+    def error(self):
+        """The exception that prevented getting a response from the MCU, if any"""
+        return self._error
+
+
+class CommandProfile:
+    """Execution time statistics of a command, used to pace polling while the MCU reports "pending"
+
+    The first poll is timed a bit before the expected completion, later polls back off exponentially. The expected
+    latency starts from the declared value and follows the observed completion times."""
+
+    smoothing = 0.25
+    first_poll_ratio = 0.75
+    min_poll_interval = 0.0005  # [seconds]
+    max_poll_interval = 0.01  # [seconds]
+
+    def __init__(self, expected_latency=0.0, max_response_length=0, priority=Priority.Configuration):
+        self._expected_latency = expected_latency
+        self._max_response_length = max_response_length
+        self._priority = priority
+        self._executions = 0
+        self._last_polls = 0
+        self._max_polls = 0
+        self._total_polls = 0
+
+    @property
+    def expected_latency(self):
+        return self._expected_latency
+
+    @property
+    def max_response_length(self):
+        """Longest response payload seen (or declared), used to read header and payload in one transfer"""
+        return self._max_response_length
+
+    @property
+    def priority(self):
+        """Bus access class of the command, see Priority"""
+        return self._priority
+
+    @property
+    def first_poll_delay(self):
+        return self._expected_latency * self.first_poll_ratio
+
+    @property
+    def first_poll_interval(self):
+        return clip(self._expected_latency / 8, self.min_poll_interval, self.max_poll_interval)
+
+    @property
+    def executions(self):
+        return self._executions
+
+    @property
+    def last_polls(self):
+        """Number of result polls the last execution needed"""
+        return self._last_polls
+
+    @property
+    def max_polls(self):
+        return self._max_polls
+
+    @property
+    def total_polls(self):
+        return self._total_polls
+
+    def record(self, latency, polls):
+        self._executions += 1
+        self._last_polls = polls
+        self._total_polls += polls
+        self._max_polls = max(self._max_polls, polls)
+
+        if polls:
+            # only commands that went pending carry information about their execution time
+            self._expected_latency += self.smoothing * (latency - self._expected_latency)
+
+    def record_response_length(self, length):
+        if length > self._max_response_length:
+            self._max_response_length = length
+
 
 class RevvyTransport:
+    busy_poll_interval = 0.0002  # [seconds] initial wait after the slave responded with "busy"
+    max_busy_poll_interval = 0.005  # [seconds]
 
-    def __init__(self, transport: RevvyTransportInterface):
+    def __init__(self, transport: RevvyTransportInterface, arbiter: BusArbiter = None):
+        """Transports of devices that share a bus must share the arbiter as well"""
         self.timeout = 5  # [seconds] how long the slave is allowed to respond with "busy"
         self._transport = transport
-        self._mutex = Lock()
+        self._arbiter = arbiter or BusArbiter()
+        self._frame_writer = FrameWriter()
+        self._header = ResponseHeader()
+        self._response_bytes = b''
+        self._attempts = 0
+        self._profiles = {}
+        self._metrics = TransportMetrics()
+
+        # commands that are pending on the MCU, the bus is released while waiting for them
+        self._pending_commands = {}
+
+        # corrupted reads are retried after a short pause, with the errors logged at most once in every 5 seconds
+        self.read_retry_policy = RetryPolicy(5, ExponentialBackoff(0.0002, 0.002),
+                                             retry_on=(TransportException, OSError, ValueError),
+                                             reporter=SampledErrorReporter('RevvyTransport'))
+
+        # stop hammering the bus when the MCU does not respond at all, e.g. while it is rebooting
+        self.circuit_breaker = CircuitBreaker()
+
+    @property
+    def metrics(self) -> TransportMetrics:
+        return self._metrics
+
+    def declare_command_profile(self, command, expected_latency=0.0, max_response_length=0,
+                                priority=Priority.Configuration):
+        """Set the bus priority and the initial latency and response length estimates of a command, unless it is
+        already known"""
+        if command not in self._profiles:
+            self._profiles[command] = CommandProfile(expected_latency, max_response_length, priority)
+
+    def command_profile(self, command) -> CommandProfile:
+        try:
+            return self._profiles[command]
+        except KeyError:
+            profile = CommandProfile()
+            self._profiles[command] = profile
+            return profile
+
+    @property
+    def command_profiles(self):
+        return dict(self._profiles)
 
     def send_command(self, command, payload=bytes()) -> Response:
         """Send a command and get the result."""
-        with self._mutex:
-            # once a command gets through and a valid response is read, this loop will exit
-            while True:  # assume that integrity error is random and not caused by implementation differences
-                # send command and read back status
-                header = self._send_command(Command.start(command, payload))
-
-                # wait for command execution to finish
-                while header.status == ResponseHeader.Status_Pending:
-                    header = self._send_command(Command.get_result(command))
-
-                # check result
-                # return a result even in case of an error, except when we know we have to resend
-                if header.status != ResponseHeader.Status_Error_CommandIntegrityError:
-                    response_payload = self._read_payload(header)
-                    return Response(header.status, response_payload)
-
-    def _read_response_header(self, retries=5):
-
-        def _read_response_header_once():
-            header_bytes = self._transport.read(ResponseHeader.length)
-            has_valid_response = ResponseHeader.is_valid_header(header_bytes)
-            if not has_valid_response:
-                return False
-            return ResponseHeader(header_bytes)
-
-        header = retry(_read_response_header_once, retries)
-
-        if not header:
+        payload = bytes(payload)
+        priority = self.command_profile(command).priority
+        self._acquire_bus(priority)
+        try:
+            return self._execute(command, payload, priority)
+        finally:
+            self._arbiter.release()
+
+    def send_batch(self, commands) -> list:
+        """Send a list of (command, payload) pairs without giving up the bus to less urgent requests
+
+        Returns a Response for every item. An item that could not be transferred does not stop the batch: its
+        Response has no status and carries the exception in Response.error. The batch gets the bus with the
+        priority of its most urgent command, and hands it over between the commands to requests that are more
+        urgent than that."""
+        if not commands:
+            return []
+
+        responses = []
+        priority = min(self.command_profile(command).priority for command, _ in commands)
+        self._acquire_bus(priority)
+        try:
+            for command, payload in commands:
+                if responses:
+                    waited = self._arbiter.handover(priority)
+                    if waited:
+                        self._metrics.record_queueing(priority, waited)
+
+                try:
+                    responses.append(self._execute(command, bytes(payload), priority))
+                except (TransportException, OSError) as e:
+                    responses.append(Response(None, b'', e))
+        finally:
+            self._arbiter.release()
+
+        return responses
+
+    def _acquire_bus(self, priority):
+        waited = self._arbiter.acquire(priority)
+        self._metrics.record_queueing(priority, waited)
+
+    def _pause(self, delay, priority):
+        """Sleep without holding the bus, then get it back with the given priority"""
+        self._arbiter.release()
+        try:
+            time.sleep(delay)
+        finally:
+            self._acquire_bus(priority)
+
+    def _execute(self, command, payload, priority) -> Response:
+        if not self.circuit_breaker.allow():
+            self._metrics.circuit_rejections += 1
+            raise CircuitOpenError('MCU is not responding')
+
+        start = time.monotonic()
+        try:
+            response = self._execute_once(command, payload, priority)
+        except (TransportException, OSError) as e:
+            self.circuit_breaker.record_failure()
+            self._metrics.record_failure(command, start, time.monotonic(), e)
+            raise
+
+        self.circuit_breaker.record_success()
+
+        self._metrics.record_transaction(command, start, time.monotonic(),
+                                         response.status != ResponseHeader.Status_Ok)
+        return response
+
+    def _execute_once(self, command, payload, priority) -> Response:
+        profile = self.command_profile(command)
+
+        # the MCU keeps one result per command, don't start the command again while it is pending
+        while command in self._pending_commands:
+            finished = self._pending_commands[command]
+            self._arbiter.release()
+            try:
+                finished.wait()
+            finally:
+                self._acquire_bus(priority)
+
+        # commands that usually go pending answer the start request without payload, don't read ahead for them
+        read_ahead = profile.max_response_length if profile.expected_latency == 0 else 0
+
+        # once a command gets through and a valid response is read, this loop will exit
+        while True:  # assume that integrity error is random and not caused by implementation differences
+            # send command and read back status
+            # the frame is encoded in every iteration: other transactions may use the writer while this one waits
+            start_frame = self._frame_writer.write(Command.OpStart, command, payload)
+            header = self._send_command(start_frame, read_ahead)
+
+            # wait for command execution to finish
+            if header.status == ResponseHeader.Status_Pending:
+                header = self._wait_for_result(command, profile, priority)
+            else:
+                profile.record(0, 0)
+
+            # check result
+            # return a result even in case of an error, except when we know we have to resend
+            if header.status != ResponseHeader.Status_Error_CommandIntegrityError:
+                response_payload = self._read_payload(header)
+                profile.record_response_length(header.payload_length)
+                return Response(header.status, response_payload)
+
+            self._metrics.integrity_resends += 1
+
+    def _read_response_header(self, read_ahead=0):
+        """Read the response header, and speculatively read_ahead bytes of the payload in the same transfer
+
+        The header object is reused for every transaction, the bytes read are kept in _response_bytes."""
+        self._attempts = 0
+        success = self.read_retry_policy.run(self._read_response_header_once, read_ahead)
+        self._metrics.reads += self._attempts
+        self._metrics.header_retries += self._attempts - 1
+
+        if not success:
             raise BrokenPipeError('Read response header: Retry limit reached')
-        return header
+        return self._header
 
-    def _read_payload(self, header, retries=5):
-        if header.payload_length == 0:
-            return []
+    def _read_response_header_once(self, read_ahead):
+        self._attempts += 1
 
-        def _read_payload_once():
-            response_bytes = self._transport.read(header.length + header.payload_length)
-            if ResponseHeader.is_valid_header(response_bytes):
-                if not header.is_same_header(response_bytes):
-                    raise ValueError('Read payload: Unexpected header received')
+        response_bytes = self._transport.read(ResponseHeader.length + read_ahead)
+        if not ResponseHeader.is_valid_header(response_bytes):
+            return False
 
-                payload_bytes = response_bytes[ResponseHeader.length:]
-                has_valid_payload = header.validate_payload(payload_bytes)
-                if has_valid_payload:
+        self._header.update(response_bytes)
+        self._response_bytes = response_bytes
+        return True
+
+    def _read_payload(self, header):
+        payload_length = header.payload_length
+        if payload_length == 0:
+            return b''
+
+        response_bytes = self._response_bytes
+        if len(response_bytes) > ResponseHeader.length:
+            if len(response_bytes) >= ResponseHeader.length + payload_length:
+                payload_bytes = response_bytes[ResponseHeader.length:ResponseHeader.length + payload_length]
+                if header.validate_payload(payload_bytes):
+                    self._metrics.read_ahead_hits += 1
                     return payload_bytes
 
-            return False
+            # guess was too short or the payload was damaged, fall back to reading the whole response again
+            self._metrics.read_ahead_misses += 1
 
-        payload = retry(_read_payload_once, retries)
+        self._attempts = 0
+        payload = self.read_retry_policy.run(self._read_payload_once, header)
+        self._metrics.reads += self._attempts
+        self._metrics.payload_retries += self._attempts - 1
 
         if not payload:
             raise BrokenPipeError('Read payload: Retry limit reached')
 
         return payload
 
-    def _send_command(self, command: Command):
+    def _read_payload_once(self, header):
+        self._attempts += 1
+
+        response_bytes = self._transport.read(header.length + header.payload_length)
+        if ResponseHeader.is_valid_header(response_bytes):
+            if not header.is_same_header(response_bytes):
+                raise ValueError('Read payload: Unexpected header received')
+
+            payload_bytes = response_bytes[ResponseHeader.length:]
+            if header.validate_payload(payload_bytes):
+                return payload_bytes
+
+        return False
+
+    def _wait_for_result(self, command, profile: CommandProfile, priority):
+        """Poll the result of a pending command, paced by the command's latency profile
+
+        The bus is released between the polls, other commands can be executed while the MCU works on this one."""
+        get_result_frame = empty_frame(Command.OpGetResult, command)
+        finished = Event()
+        self._pending_commands[command] = finished
+
+        started = time.monotonic()
+        deadline = started + max(self.timeout, 10 * profile.expected_latency)
+
+        delay = profile.first_poll_delay
+        interval = profile.first_poll_interval
+        polls = 0
+        try:
+            while True:
+                if delay > 0:
+                    self._pause(delay, priority)
+
+                header = self._send_command(get_result_frame, profile.max_response_length)
+                polls += 1
+                self._metrics.pending_polls += 1
+
+                now = time.monotonic()
+                if header.status != ResponseHeader.Status_Pending:
+                    profile.record(now - started, polls)
+                    return header
+
+                if self.timeout != 0 and now > deadline:
+                    raise TimeoutError('Command {:X} did not finish after {} polls'.format(command, polls))
+
+                delay = interval
+                interval = min(2 * interval, profile.max_poll_interval)
+        finally:
+            del self._pending_commands[command]
+            finished.set()
+
+    def _send_command(self, frame, read_ahead=0):
         """
-        Send a command, wait for a proper response and return the response header
+        Send an encoded command frame, wait for a proper response and return the response header
         """
-        self._transport.write(command.get_bytes())
-        start = time.time()
-        while self.timeout == 0 or time.time() - start < self.timeout:
-            response = self._read_response_header()
+        self._transport.write(frame)
+        self._metrics.writes += 1
+        deadline = time.monotonic() + self.timeout
+        interval = self.busy_poll_interval
+        while True:
+            response = self._read_response_header(read_ahead)
             if response.status != ResponseHeader.Status_Busy:
                 return response
-        raise TimeoutError
+
+            self._metrics.busy_responses += 1
+
+            if self.timeout != 0 and time.monotonic() >= deadline:
+                raise TimeoutError
+
+            # the bus is kept: a command sent now would replace the response the MCU is preparing
+            time.sleep(interval)
+            interval = min(2 * interval, self.max_busy_poll_interval)
@@ -0,0 +1,219 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+from threading import Lock, Event
+
+from revvy.mcu.rrrc_transport import RevvyTransport, ResponseHeader, Response
+from revvy.retry_policy import SampledErrorReporter
+from revvy.thread_wrapper import ThreadWrapper, ThreadContext
+
+
+def _status_error(command, status):
+    try:
+        status_string = ResponseHeader.StatusStrings[status]
+    except IndexError:
+        status_string = 'Unknown status (code {})'.format(status)
+    return ValueError('Command {:X} status: "{}"'.format(command, status_string))
+
+
+class SetpointOutbox:
+    """Coalesces setpoint commands so that only the latest value of each is sent to the MCU
+
+    Until the outbox is started the commands are passed through to the transport unchanged. While running, commands
+    are stored keyed by (command, port) and a newer setpoint replaces the pending one. The flusher thread sends
+    the pending setpoints whenever it gets access to the bus, so the callers never wait for the bus and the age
+    of a sent setpoint is bounded by a single bus transaction.
+
+    Pending setpoints are sent in the order they were last issued: drivetrain and motor commands control the same
+    motors, so the one issued last must be applied last.
+
+    Every setpoint gets a sequence number. Status data only reflects a setpoint if it was read after the setpoint
+    was sent, which can be checked by comparing the sequence number to status_sequence.
+
+    The callers don't wait for their setpoints, so failures can't be returned to them. Failures are logged through a
+    SampledErrorReporter (transport errors also count towards the circuit breaker of the transport), passed to the
+    on_failed callback, and the error of the last sent setpoint is kept for every (command, port), see last_failure().
+
+    >>> class Transport:
+    ...     def send_batch(self, commands):
+    ...         print([command for command, _ in commands])
+    ...         raise OSError('bus error')
+    >>> outbox = SetpointOutbox(Transport())
+    >>> outbox._is_running = True
+    >>> outbox.key_by_port(0x14)
+    >>> for command, payload in ((0x1B, b'a'), (0x14, b'\x01b'), (0x1B, b'c')):
+    ...     outbox.send_command(command, payload)
+    >>> outbox.on_failed(lambda command, payload, error: print('failed: {:X} {}'.format(command, error)))
+    >>> outbox.flush()  # doctest: +ELLIPSIS
+    [20, 27]
+    SetpointOutbox: ...
+    failed: 14 bus error
+    failed: 1B bus error
+    >>> outbox.sequence, outbox.sent_sequence, outbox.failed
+    (3, 3, 2)
+    >>> outbox.last_failure(0x14, 1), outbox.last_failure(0x14, 2)
+    (OSError('bus error'), None)
+    """
+
+    def __init__(self, transport: RevvyTransport):
+        self._transport = transport
+        self._port_commands = set()
+        self._lock = Lock()
+        self._has_pending = Event()
+        self._pending = {}
+        self._is_running = False
+
+        self._sent = 0
+        self._dropped = 0
+        self._failed = 0
+        self._failed_callback = lambda command, payload, error: None
+        self._failures = {}
+        self._reporter = SampledErrorReporter('SetpointOutbox')
+        self._issued_callback = lambda: None
+
+        self._sequence = 0
+        self._sent_sequence = 0
+        self._status_sequence = 0
+
+    def key_by_port(self, command):
+        """Coalesce the given command separately for each port (the first payload byte)"""
+        self._port_commands.add(command)
+
+    @property
+    def sent(self):
+        return self._sent
+
+    @property
+    def dropped(self):
+        """Number of setpoints that were replaced by a newer one before they could be sent"""
+        return self._dropped
+
+    @property
+    def failed(self):
+        """Number of setpoints that the MCU did not accept, or that could not be sent"""
+        return self._failed
+
+    def last_failure(self, command, port=None):
+        """The error of the last sent setpoint of command (for the port, if the command is keyed by port), None if
+        it was accepted by the MCU"""
+        key = (command, port) if command in self._port_commands else (command, None)
+        return self._failures.get(key)
+
+    def on_failed(self, cb):
+        """Call cb(command, payload, error) when a queued setpoint could not be sent"""
+        self._failed_callback = cb if callable(cb) else lambda command, payload, error: None
+
+    def on_issued(self, cb):
+        """Call cb() after a setpoint is queued or sent"""
+        self._issued_callback = cb if callable(cb) else lambda: None
+
+    @property
+    def sequence(self):
+        """Sequence number of the last issued setpoint"""
+        return self._sequence
+
+    @property
+    def sent_sequence(self):
+        """Every setpoint up to this sequence number has been sent (or has failed, or was dropped)"""
+        return self._sent_sequence
+
+    @property
+    def status_sequence(self):
+        """The status being processed was read after the setpoints up to this sequence number were sent"""
+        return self._status_sequence
+
+    def mark_status_read(self):
+        """Called before reading the status of the MCU"""
+        self._status_sequence = self._sent_sequence
+
+    def _mark_sent(self, sequence):
+        with self._lock:
+            self._sent_sequence = max(self._sent_sequence, sequence)
+
+    def _key(self, command, payload):
+        return (command, payload[0]) if command in self._port_commands else (command, None)
+
+    def send_command(self, command, payload=bytes()):
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+
+            if self._is_running:
+                key = self._key(command, payload)
+
+                # the replaced setpoint loses its place in the sending order
+                if self._pending.pop(key, None) is not None:
+                    self._dropped += 1
+                self._pending[key] = (command, payload, sequence)
+                self._has_pending.set()
+                queued = True
+            else:
+                queued = False
+
+        if queued:
+            self._issued_callback()
+            return None
+
+        try:
+            response = self._transport.send_command(command, payload)
+        except Exception as e:
+            self._failures[self._key(command, payload)] = e
+            raise
+        finally:
+            self._mark_sent(sequence)
+            self._issued_callback()
+
+        self._failures[self._key(command, payload)] = None if response.status == ResponseHeader.Status_Ok \
+            else _status_error(command, response.status)
+        return response
+
+    def clear(self):
+        """Drop the pending setpoints, e.g. because the configuration they belong to is no longer valid"""
+        with self._lock:
+            self._dropped += len(self._pending)
+            self._pending = {}
+            self._has_pending.clear()
+            self._sent_sequence = self._sequence
+
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+            self._has_pending.clear()
+
+        if not pending:
+            return
+
+        commands = [(command, payload) for command, payload, _ in pending]
+        try:
+            responses = self._transport.send_batch(commands)
+        except Exception as e:
+            responses = [Response(None, b'', e)] * len(commands)
+
+        for (command, payload), response in zip(commands, responses):
+            if response.error is not None or response.status != ResponseHeader.Status_Ok:
+                error = response.error or _status_error(command, response.status)
+                self._failed += 1
+                self._failures[self._key(command, payload)] = error
+                self._reporter.report(error)
+                self._failed_callback(command, payload, error)
+            else:
+                self._sent += 1
+                self._failures[self._key(command, payload)] = None
+
+        self._mark_sent(pending[-1][2])
+
+    def run(self, ctx: ThreadContext):
+        ctx.on_stopped(self._has_pending.set)
+
+        self._is_running = True
+        try:
+            while not ctx.stop_requested:
+                self._has_pending.wait()
+                self.flush()
+        finally:
+            self._is_running = False
+            self.flush()
+
+
+def create_setpoint_outbox_thread(outbox: SetpointOutbox):
+    return ThreadWrapper(outbox.run, "SetpointOutboxThread")
@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+from threading import Lock
+
+from revvy.mcu.rrrc_transport import RevvyTransport, Response, ResponseHeader
+
+
+class StateCache:
+    """Write-through shadow of state that is set on the MCU
+
+    Commands sent through the cache are skipped, and answered with an empty Ok response, if their payload is the same
+    as the last one the MCU has acknowledged. The state is stored keyed by command, or by (command, port) for commands
+    registered with key_by_port. Any error clears the whole cache because the MCU state is unknown afterwards, and
+    the cache must be invalidated when the MCU may have been reset.
+
+    >>> from revvy.mcu.emulator import McuEmulator
+    >>> cache = StateCache(RevvyTransport(McuEmulator()))
+    >>> [cache.send_command(0x31, [2]).status for _ in range(3)]
+    [0, 0, 0]
+    >>> cache.saved
+    2
+    """
+
+    def __init__(self, transport: RevvyTransport):
+        self._transport = transport
+        self._port_commands = set()
+        self._lock = Lock()
+        self._state = {}
+        self._saved = 0
+
+    def key_by_port(self, command):
+        """Store the state of the given command separately for each port (the first payload byte)"""
+        self._port_commands.add(command)
+
+    @property
+    def saved(self):
+        """Number of commands that did not have to be sent"""
+        return self._saved
+
+    def invalidate(self):
+        with self._lock:
+            self._state = {}
+
+    def send_command(self, command, payload=bytes()):
+        payload = bytes(payload)
+        key = (command, payload[0]) if command in self._port_commands else (command, None)
+
+        # state setters are rare, holding the lock while sending keeps the cache in the order the MCU received them
+        with self._lock:
+            if self._state.get(key) == payload:
+                self._saved += 1
+                return Response(ResponseHeader.Status_Ok, b'')
+
+            try:
+                response = self._transport.send_command(command, payload)
+            except Exception:
+                self._state = {}
+                raise
+
+            if response is None:
+                # queued in a batch, not acknowledged yet
+                self._state.pop(key, None)
+            elif response.status == ResponseHeader.Status_Ok:
+                self._state[key] = payload
+            else:
+                self._state = {}
+
+            return response
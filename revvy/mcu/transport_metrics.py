@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+from bisect import bisect_left
+
+from revvy.mcu.bus_arbiter import Priority
+
+
+class LatencyHistogram:
+    """Latency histogram with fixed bucket limits
+
+    >>> h = LatencyHistogram()
+    >>> h.record(0.0003)
+    >>> h.record(0.004)
+    >>> h.count, h.max
+    (2, 0.004)
+    >>> h.percentile(50)
+    0.0005
+    """
+
+    # [seconds] upper limits of the buckets, the last bucket collects everything above the last limit
+    bucket_limits = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5, 1.0)
+
+    def __init__(self):
+        self._buckets = [0] * (len(self.bucket_limits) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, value):
+        self._buckets[bisect_left(self.bucket_limits, value)] += 1
+        self._count += 1
+        self._total += value
+        if value > self._max:
+            self._max = value
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._total / self._count if self._count else 0.0
+
+    @property
+    def max(self):
+        return self._max
+
+    def percentile(self, p):
+        """Return the upper limit of the bucket that contains the given percentile"""
+        threshold = self._count * p / 100
+        seen = 0
+        for idx, count in enumerate(self._buckets):
+            seen += count
+            if count and seen >= threshold:
+                return self.bucket_limits[idx] if idx < len(self.bucket_limits) else self._max
+        return 0.0
+
+    def snapshot(self):
+        return {
+            'count':   self._count,
+            'mean':    self.mean,
+            'max':     self._max,
+            'p50':     self.percentile(50),
+            'p99':     self.percentile(99),
+            'buckets': list(self._buckets)
+        }
+
+
+class CommandMetrics:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.error_responses = 0
+        self.failures = 0
+
+    def snapshot(self):
+        return {
+            **self.latency.snapshot(),
+            'error_responses': self.error_responses,
+            'failures':        self.failures
+        }
+
+
+class BusUtilization:
+    """Tracks which portion of each period the bus was busy
+
+    Busy time is attributed to the period in which the transaction ended."""
+
+    smoothing = 0.05
+
+    def __init__(self, period=0.02):
+        self._period = period
+        self._window_start = None
+        self._busy = 0.0
+        self._last = 0.0
+        self._average = 0.0
+        self._peak = 0.0
+
+    def record(self, start, end):
+        if self._window_start is None:
+            self._window_start = start
+
+        self._busy += end - start
+
+        if end - self._window_start >= self._period:
+            self._close_window(end)
+
+    def _close_window(self, now):
+        elapsed = now - self._window_start
+        utilization = min(1.0, self._busy / elapsed)
+
+        self._last = utilization
+        self._average += self.smoothing * (utilization - self._average)
+        self._peak = max(self._peak, utilization)
+
+        self._window_start = now
+        self._busy = 0.0
+
+    def snapshot(self):
+        return {
+            'period':  self._period,
+            'last':    self._last,
+            'average': self._average,
+            'peak':    self._peak
+        }
+
+
+class TransportMetrics:
+    """Counters and histograms describing the MCU link
+
+    Updated by RevvyTransport while it holds the bus, so recording does not need any extra locking. Reading is not
+    synchronized, a snapshot may mix values from neighbouring transactions."""
+
+    def __init__(self, utilization_period=0.02):
+        self._utilization_period = utilization_period
+        self.reset()
+
+    def reset(self):
+        self._commands = {}
+        self._queueing = [LatencyHistogram() for _ in Priority.names]
+        self.bus_utilization = BusUtilization(self._utilization_period)
+
+        self.transactions = 0
+        self.writes = 0
+        self.reads = 0
+        self.read_ahead_hits = 0
+        self.read_ahead_misses = 0
+        self.header_retries = 0
+        self.payload_retries = 0
+        self.integrity_resends = 0
+        self.busy_responses = 0
+        self.pending_polls = 0
+        self.timeouts = 0
+        self.transport_errors = 0
+        self.circuit_rejections = 0
+
+    def command(self, command) -> CommandMetrics:
+        try:
+            return self._commands[command]
+        except KeyError:
+            metrics = CommandMetrics()
+            self._commands[command] = metrics
+            return metrics
+
+    def record_queueing(self, priority, delay):
+        """Time a request spent waiting for the bus"""
+        self._queueing[priority].record(delay)
+
+    def record_transaction(self, command, start, end, is_error_response):
+        self.transactions += 1
+
+        metrics = self.command(command)
+        metrics.latency.record(end - start)
+        if is_error_response:
+            metrics.error_responses += 1
+
+        self.bus_utilization.record(start, end)
+
+    def record_failure(self, command, start, end, error):
+        if isinstance(error, TimeoutError):
+            self.timeouts += 1
+        else:
+            self.transport_errors += 1
+
+        self.command(command).failures += 1
+        self.bus_utilization.record(start, end)
+
+    def snapshot(self):
+        return {
+            'transactions':       self.transactions,
+            'writes':             self.writes,
+            'reads':              self.reads,
+            'read_ahead_hits':    self.read_ahead_hits,
+            'read_ahead_misses':  self.read_ahead_misses,
+            'header_retries':     self.header_retries,
+            'payload_retries':    self.payload_retries,
+            'integrity_resends':  self.integrity_resends,
+            'busy_responses':     self.busy_responses,
+            'pending_polls':      self.pending_polls,
+            'timeouts':           self.timeouts,
+            'transport_errors':   self.transport_errors,
+            'circuit_rejections': self.circuit_rejections,
+            'bus_utilization':    self.bus_utilization.snapshot(),
+            'queueing':           {name: hist.snapshot() for name, hist in zip(Priority.names, self._queueing)},
+            'commands':           {command: metrics.snapshot() for command, metrics in list(self._commands.items())}
+        }
@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+import traceback
+
+
+class NoBackoff:
+    def delay(self, attempt):
+        return 0
+
+
+class ConstantBackoff:
+    def __init__(self, delay):
+        self._delay = delay
+
+    def delay(self, attempt):
+        return self._delay
+
+
+class ExponentialBackoff:
+    """
+    >>> backoff = ExponentialBackoff(0.1, 0.5)
+    >>> [backoff.delay(attempt) for attempt in range(1, 5)]
+    [0.1, 0.2, 0.4, 0.5]
+    """
+    def __init__(self, initial, maximum, factor=2):
+        self._initial = initial
+        self._maximum = maximum
+        self._factor = factor
+
+    def delay(self, attempt):
+        return min(self._maximum, self._initial * self._factor ** (attempt - 1))
+
+
+class SampledErrorReporter:
+    """Prints the first error of each kind, then at most one summary of the same kind of errors per interval"""
+
+    def __init__(self, name, interval=5.0):
+        self._name = name
+        self._interval = interval
+        self._last_report = {}
+        self._suppressed = {}
+
+    def report(self, error):
+        kind = type(error).__name__
+        now = time.monotonic()
+        last = self._last_report.get(kind)
+        if last is not None and now - last < self._interval:
+            self._suppressed[kind] = self._suppressed.get(kind, 0) + 1
+            return
+
+        self._last_report[kind] = now
+        suppressed = self._suppressed.pop(kind, 0)
+        if suppressed:
+            print('{}: {} ({} similar errors suppressed)'.format(self._name, repr(error), suppressed))
+        else:
+            print('{}: {}'.format(self._name, ''.join(traceback.format_exception(type(error), error,
+                                                                                  error.__traceback__))))
+
+
+class CircuitOpenError(BrokenPipeError):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast after a number of consecutive failures
+
+    After reset_timeout, a single call is let through to check whether the other side has recovered.
+
+    >>> breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    >>> breaker.record_failure(); breaker.record_failure()
+    CircuitBreaker: 2 consecutive failures, failing fast
+    >>> breaker.is_open, breaker.allow()
+    (True, False)
+    >>> breaker.record_success()
+    >>> breaker.allow()
+    True
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=0.5):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._rejected = 0
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    @property
+    def rejected(self):
+        """Number of calls that were refused while the circuit was open"""
+        return self._rejected
+
+    def allow(self):
+        if self._opened_at is None:
+            return True
+
+        now = time.monotonic()
+        if now - self._opened_at >= self._reset_timeout:
+            # half open: let this call through, a failure opens the circuit for another period
+            self._opened_at = now
+            return True
+
+        self._rejected += 1
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._failures >= self._failure_threshold and self._opened_at is None:
+            print('CircuitBreaker: {} consecutive failures, failing fast'.format(self._failures))
+            self._opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """Calls a function (with the given arguments) until it returns a truthy value or None, or the attempts run out
+
+    Exceptions listed in fatal are raised immediately, exceptions listed in retry_on are reported through the
+    reporter and retried, anything else is raised. retries=None retries forever. Returns the last result or False.
+
+    >>> policy = RetryPolicy(3, retry_on=(ValueError,))
+    >>> results = iter([False, 0, 'ok'])
+    >>> policy.run(lambda: next(results))
+    'ok'
+    >>> policy.run(lambda: int('x'), report=False)
+    False
+    """
+
+    def __init__(self, retries=5, backoff=NoBackoff(), retry_on=(Exception,), fatal=(), reporter=None):
+        self._retries = retries
+        self._backoff = backoff
+        self._retry_on = retry_on
+        self._fatal = fatal
+        self._reporter = reporter or SampledErrorReporter('RetryPolicy')
+
+    def run(self, fn, *args, report=True):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = fn(*args)
+                if result is None:
+                    return True
+                if result:
+                    return result
+            except self._fatal:
+                raise
+            except self._retry_on as e:
+                if report:
+                    self._reporter.report(e)
+
+            if self._retries is not None and attempt >= self._retries:
+                return False
+
+            delay = self._backoff.delay(attempt)
+            if delay:
+                time.sleep(delay)
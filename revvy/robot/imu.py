@@ -7,6 +7,10 @@ Vector3D = collections.namedtuple('Vector3D', ['x', 'y', 'z'])
 
 
 class IMU:
+    # status slot layouts
+    vector_format = struct.Struct('<hhh')
+    yaw_format = struct.Struct('<ll')  # absolute, relative
+
     def __init__(self):
         self._acceleration = Vector3D(0, 0, 0)
         self._rotation = Vector3D(0, 0, 0)
@@ -29,16 +33,12 @@ class IMU:
     def rotation(self):
         return self._rotation
 
-    @staticmethod
-    def _read_vector(data, lsb_value):
-        (x, y, z) = struct.unpack('<hhh', bytes(data))
-        return Vector3D(x * lsb_value, y * lsb_value, z * lsb_value)
-
-    def update_yaw_angles(self, data):
-        (self._yaw_angle, self._relative_yaw_angle) = struct.unpack('<ll', bytes(data))
+    def update_yaw_angles(self, yaw_angle, relative_yaw_angle):
+        self._yaw_angle = yaw_angle
+        self._relative_yaw_angle = relative_yaw_angle
 
-    def update_axl_data(self, data):
-        self._acceleration = self._read_vector(data, 0.061)
+    def update_axl_data(self, x, y, z):
+        self._acceleration = Vector3D(x * 0.061, y * 0.061, z * 0.061)
 
-    def update_gyro_data(self, data):
-        self._rotation = self._read_vector(data, 0.035)
+    def update_gyro_data(self, x, y, z):
+        self._rotation = Vector3D(x * 0.035, y * 0.035, z * 0.035)
@@ -11,9 +11,9 @@ class RingLed:
     BusyIndicator = 4
     BreathingGreen = 5
 
-    def __init__(self, interface: RevvyControl):
+    def __init__(self, interface: RevvyControl, led_count=None):
         self._interface = interface
-        self._ring_led_count = self._interface.ring_led_get_led_amount()
+        self._ring_led_count = led_count if led_count is not None else self._interface.ring_led_get_led_amount()
         self._current_scenario = self.BreathingGreen
 
     @property
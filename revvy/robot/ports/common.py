@@ -45,6 +45,10 @@ class PortHandler:
     def port_count(self):
         return self._port_count
 
+    def update_types(self, supported: dict):
+        """Replace the port type ids, they are used the next time a port is configured"""
+        self._types = supported
+
     def reset(self):
         for port in self:
             port.uninitialize()
@@ -68,11 +72,19 @@ class PortInstance:
         self._interface = interface
         self._driver = owner._drivers["NotConfigured"](self, None)
         self._config_changed_callback = lambda port, cfg_name: None
+        self._status_invalidated_callback = lambda port: None
         self._configuration = "NotConfigured"
 
     def on_config_changed(self, callback):
         self._config_changed_callback = callback
 
+    def on_status_invalidated(self, callback):
+        self._status_invalidated_callback = callback
+
+    def invalidate_status(self):
+        """Request the next status update even if the status of the port did not change"""
+        self._status_invalidated_callback(self)
+
     def _notify_config_changed(self, config_name):
         self._config_changed_callback(self, config_name)
 
@@ -11,10 +11,27 @@ import struct
 
 DcMotorStatus = namedtuple("DcMotorStatus", ['position', 'speed', 'power'])
 
+# position limits, position controller, speed controller, encoder resolution
+_config_format = struct.Struct('<ll5f5fh')
 
-def create_motor_port_handler(interface: RevvyControl, configs: dict):
-    port_amount = interface.get_motor_port_amount()
-    port_types = interface.get_motor_port_types()
+# control requests start with the request type
+_power_request = struct.Struct('<Bb')
+_speed_request = struct.Struct('<Bf')
+_speed_request_with_limit = struct.Struct('<Bff')
+_position_request = struct.Struct('<Bl')
+_position_request_with_limits = struct.Struct('<Blff')
+_position_request_with_limit = struct.Struct('<Blbf')  # the flag selects speed (1) or power (0) limit
+
+_status_format = struct.Struct('<lfb')
+_status_format_with_pos_reached = struct.Struct('<lfbb')
+
+
+def create_motor_port_handler(interface: RevvyControl, configs: dict, port_amount=None, port_types=None):
+    """Create the port handler, port_amount and port_types are read from the MCU unless given"""
+    if port_amount is None:
+        port_amount = interface.get_motor_port_amount()
+    if port_types is None:
+        port_types = interface.get_motor_port_types()
 
     drivers = {
         'NotConfigured': NullMotor,
@@ -49,6 +66,10 @@ class NullMotor:
     def is_moving(self):
         return False
 
+    @property
+    def setpoint_error(self):
+        return None
+
     def set_speed(self, speed, power_limit=None):
         pass
 
@@ -81,23 +102,32 @@ class DcMotorController:
         self._power = 0
         self._pos_reached = None
 
+        # sequence number of the last setpoint, and of the last one that the status data reflects
+        self._setpoint_sequence = 0
+        self._status_sequence = 0
+
         (posMin, posMax) = port_config['position_limits']
         (posP, posI, posD, speedLowerLimit, speedUpperLimit) = port_config['position_controller']
         (speedP, speedI, speedD, powerLowerLimit, powerUpperLimit) = port_config['speed_controller']
 
-        config = list(struct.pack("<ll", posMin, posMax))
-        config += list(struct.pack("<{}".format("f" * 5), posP, posI, posD, speedLowerLimit, speedUpperLimit))
-        config += list(struct.pack("<{}".format("f" * 5), speedP, speedI, speedD, powerLowerLimit, powerUpperLimit))
-        config += list(struct.pack("<h", port_config['encoder_resolution']))
+        config = _config_format.pack(posMin, posMax,
+                                     posP, posI, posD, speedLowerLimit, speedUpperLimit,
+                                     speedP, speedI, speedD, powerLowerLimit, powerUpperLimit,
+                                     port_config['encoder_resolution'])
 
-        print('{}: Sending configuration: {}'.format(self._name, config))
+        print('{}: Sending configuration: {}'.format(self._name, list(config)))
 
         self._configure(config)
         self._status_changed_callback = lambda p: None
 
-    def _control(self, ctrl, value, pos_ctrl=False):
+    def _control(self, request, pos_ctrl=False):
+        interface = self._port.interface
         self._pos_reached = False if pos_ctrl else None
-        self._port.interface.set_motor_port_control_value(self._port.id, [ctrl] + value)
+        interface.set_motor_port_control_value(self._port.id, request)
+        self._setpoint_sequence = interface.setpoints.sequence
+
+        # _pos_reached must be updated from the next status even if the MCU reports the same as before
+        self._port.invalidate_status()
 
     def on_status_changed(self, cb):
         if not callable(cb):
@@ -126,44 +156,55 @@ class DcMotorController:
 
     @property
     def is_moving(self):
+        if self._status_sequence < self._setpoint_sequence:
+            # the status is older than the last setpoint
+            return True
+
         stopped = math.fabs(round(self._speed, 2)) == 0 and math.fabs(self._power) < 80
         if self._pos_reached is None:
             return not stopped
         else:
             return not (self._pos_reached and stopped)
 
+    @property
+    def setpoint_error(self):
+        """Why the MCU did not apply the last sent setpoint of the motor, None if it did"""
+        interface = self._port.interface
+        return interface.setpoints.last_failure(interface.set_motor_port_control_value.command_id, self._port.id)
+
     def set_speed(self, speed, power_limit=None):
         print('{}::set_speed'.format(self._name))
-        control = list(struct.pack("<f", speed))
-        if power_limit is not None:
-            control += list(struct.pack("<f", power_limit))
-
-        self._control(1, control)
+        if power_limit is None:
+            self._control(_speed_request.pack(1, speed))
+        else:
+            self._control(_speed_request_with_limit.pack(1, speed, power_limit))
 
     def set_position(self, position: int, speed_limit=None, power_limit=None, pos_type='absolute'):
         print('{}::set_position'.format(self._name))
-        control = list(struct.pack('<l', position))
+        pos_request_types = {'absolute': 2, 'relative': 3}
+        request_type = pos_request_types[pos_type]
 
         if speed_limit is not None and power_limit is not None:
-            control += list(struct.pack("<ff", speed_limit, power_limit))
+            request = _position_request_with_limits.pack(request_type, position, speed_limit, power_limit)
         elif speed_limit is not None:
-            control += list(struct.pack("<bf", 1, speed_limit))
+            request = _position_request_with_limit.pack(request_type, position, 1, speed_limit)
         elif power_limit is not None:
-            control += list(struct.pack("<bf", 0, power_limit))
+            request = _position_request_with_limit.pack(request_type, position, 0, power_limit)
+        else:
+            request = _position_request.pack(request_type, position)
 
-        pos_request_types = {'absolute': 2, 'relative': 3}
-        self._control(pos_request_types[pos_type], control, True)
+        self._control(request, True)
 
     def set_power(self, power):
         print('{}::set_power'.format(self._name))
-        self._control(0, [power])
+        self._control(_power_request.pack(0, power))
 
     def update_status(self, data):
         if len(data) == 9:
-            (pos, speed, power) = struct.unpack('<lfb', bytearray(data))
+            (pos, speed, power) = _status_format.unpack(data)
             pos_reached = None
         elif len(data) == 10:
-            (pos, speed, power, pos_reached) = struct.unpack('<lfbb', bytearray(data))
+            (pos, speed, power, pos_reached) = _status_format_with_pos_reached.unpack(data)
         else:
             print('{}: Received {} bytes of data instead of 9 or 10'.format(self._name, len(data)))
             return
@@ -171,7 +212,14 @@ class DcMotorController:
         self._pos = pos
         self._speed = speed
         self._power = power
-        self._pos_reached = pos_reached
+
+        status_sequence = self._port.interface.setpoints.status_sequence
+        if status_sequence < self._setpoint_sequence:
+            # read before the last setpoint was sent, keep reading until the status reflects it
+            self._port.invalidate_status()
+        else:
+            self._pos_reached = pos_reached
+            self._status_sequence = status_sequence
 
         self._raise_status_changed_callback()
 
@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
+import struct
 from collections import namedtuple
 
 from revvy.mcu.rrrc_control import RevvyControl
@@ -8,10 +9,16 @@ from revvy.robot.ports.common import PortHandler, PortInstance
 
 SensorValue = namedtuple('SensorValue', ['raw', 'converted'])
 
+_bumper_format = struct.Struct('<BB')
+_ultrasonic_format = struct.Struct('<L')  # distance
 
-def create_sensor_port_handler(interface: RevvyControl, configs: dict):
-    port_amount = interface.get_sensor_port_amount()
-    port_types = interface.get_sensor_port_types()
+
+def create_sensor_port_handler(interface: RevvyControl, configs: dict, port_amount=None, port_types=None):
+    """Create the port handler, port_amount and port_types are read from the MCU unless given"""
+    if port_amount is None:
+        port_amount = interface.get_sensor_port_amount()
+    if port_types is None:
+        port_types = interface.get_sensor_port_types()
 
     drivers = {
         'NotConfigured': NullSensor,
@@ -108,8 +115,8 @@ def bumper_switch(port: PortInstance, cfg):
     sensor = BaseSensorPortDriver(port)
 
     def process_bumper(raw):
-        assert len(raw) == 2
-        return raw[0] == 1
+        (pressed, _) = _bumper_format.unpack(raw)
+        return pressed == 1
 
     sensor.convert_sensor_value = process_bumper
     return sensor
@@ -120,8 +127,7 @@ def hcsr04(port: PortInstance, cfg):
     sensor = BaseSensorPortDriver(port)
 
     def process_ultrasonic(raw):
-        assert len(raw) == 4
-        dst = int.from_bytes(raw, byteorder='little')
+        (dst,) = _ultrasonic_format.unpack(raw)
         if dst == 0:
             return None
         return dst
@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+from threading import Lock, Event
+
+
+class StatusRateScheduler:
+    """Backs the status updates off while the robot is idle
+
+    The status is read every `period` seconds (the fixed rate it used to be read at) while any of the registered
+    activity conditions is true, or data was requested in the last demand_timeout seconds, and every idle_period
+    seconds otherwise. The conditions are evaluated once per update, request_update() ends the back-off at once by
+    setting wakeup_event, which the status thread waits on.
+
+    The period is never shorter than the recent duration of an update (which includes the bus transaction) plus
+    update_margin, so the status thread always sleeps and leaves the bus to lower priority requests for a while.
+
+    The metrics compare the updates to the ones that reference_period would have made, the time saved is estimated
+    from the average duration of an update.
+
+    >>> rate = StatusRateScheduler()
+    >>> rate.next_period()
+    0.1
+    >>> rate.request_update()
+    >>> rate.wakeup_event.is_set(), rate.next_period()
+    (True, 0.02)
+    >>> for _ in range(100):
+    ...     rate.record_update(0.03)
+    >>> round(rate.next_period(), 3)
+    0.035
+    """
+
+    period = 0.02  # [seconds]
+    idle_period = 0.1  # [seconds]
+    update_margin = 0.005  # [seconds] minimum time between two updates
+    demand_timeout = 1.0  # [seconds] active period after a request_data() call
+    reference_period = 0.02  # [seconds] the fixed period the metrics are compared to
+
+    def __init__(self):
+        self._lock = Lock()
+        self._conditions = []
+        self._demand_until = 0
+        self._recent_update_time = 0.0
+        self._backed_off = False
+        self._wakeup = Event()
+        self.reset_metrics()
+
+    def add_activity(self, condition):
+        """Use the active period while condition() returns True"""
+        self._conditions.append(condition)
+
+    def request_data(self):
+        """Someone is waiting for fresh status data"""
+        self._demand_until = time.monotonic() + self.demand_timeout
+
+    def request_update(self):
+        """Someone is waiting for the status to follow a change, e.g. a setpoint was issued"""
+        self.request_data()
+        if self._backed_off:
+            self._wakeup.set()
+
+    @property
+    def wakeup_event(self):
+        """Set when the status thread should not wait for the end of the idle period"""
+        return self._wakeup
+
+    @property
+    def is_active(self):
+        return time.monotonic() < self._demand_until or any(condition() for condition in self._conditions)
+
+    def next_period(self):
+        active = self.is_active
+        with self._lock:
+            self._ticks += 1
+            if active:
+                self._active_ticks += 1
+        self._backed_off = not active
+        period = self.period if active else self.idle_period
+        return max(period, self._recent_update_time + self.update_margin)
+
+    def record_update(self, duration):
+        """Record the time an update took"""
+        with self._lock:
+            self._recent_update_time += 0.1 * (duration - self._recent_update_time)
+            self._update_time += duration
+            self._updates += 1
+
+    def reset_metrics(self):
+        with self._lock:
+            self._start = time.monotonic()
+            self._ticks = 0
+            self._active_ticks = 0
+            self._updates = 0
+            self._update_time = 0.0
+
+    def metrics(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._start
+            mean_update_time = self._update_time / self._updates if self._updates else 0.0
+            saved_updates = elapsed / self.reference_period - self._ticks
+
+            return {
+                'ticks':            self._ticks,
+                'active_ratio':     self._active_ticks / self._ticks if self._ticks else 0.0,
+                'effective_rate':   self._ticks / elapsed if elapsed else 0.0,
+                'mean_update_time': mean_update_time,
+                'saved_updates':    saved_updates,
+                'saved_time':       saved_updates * mean_update_time
+            }
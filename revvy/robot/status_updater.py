@@ -1,5 +1,7 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
+import struct
+
 from revvy.mcu.rrrc_control import RevvyControl
 
 
@@ -18,18 +20,58 @@ class McuStatusUpdater:
 
     This class is the counterpart of McuStatusUpdater/McuStatusUpdaterWrapper implemented on the MCU and is used
     to enable and read specific data slots. It was designed to read multiple pieces of data in one run to decrease
-    communication interface overhead, thus to allow lower latency updates"""
+    communication interface overhead, thus to allow lower latency updates
+
+    The handler of a slot is only called when the data of the slot differs from the previous read.
+
+    >>> from revvy.mcu.emulator import McuEmulator
+    >>> from revvy.mcu.rrrc_transport import RevvyTransport
+    >>> updater = McuStatusUpdater(RevvyControl(RevvyTransport(McuEmulator())))
+    >>> updater.reset()
+    McuStatusUpdater: reset all slots
+    >>> updater.set_slot(10, print)
+    McuStatusUpdater: enable slot 10
+    >>> updater.read() and updater.read()
+    b'\\x01d\\x00d'
+    True
+    >>> updater.slot_statistics()
+    {10: {'reads': 2, 'changes': 1, 'change_rate': 0.5}}
+    """
     def __init__(self, robot: RevvyControl):
         self._robot = robot
         self._is_enabled = [False] * 32
         self._handlers = [lambda x: None] * 32
+        self._formats = [None] * 32
+        self._last_data = [None] * 32
+        self._reads = [0] * 32
+        self._changes = [0] * 32
+        self._updated_callback = lambda: None
+
+    def on_updated(self, cb):
+        """Call cb after every read that returned data, once the slot handlers are done"""
+        self._updated_callback = cb if callable(cb) else lambda: None
 
     def reset(self):
         print('McuStatusUpdater: reset all slots')
         self._handlers = [lambda x: None] * 32
+        self._formats = [None] * 32
+        self._last_data = [None] * 32
         self._is_enabled = [False] * 32
         self._robot.status_updater_reset()
 
+    def invalidate_slot(self, slot: int):
+        """Pass the data of the slot to its handler on the next read, even if it did not change"""
+        self._last_data[slot] = None
+
+    def invalidate_all(self):
+        """Pass the data of every slot to its handler on the next read, e.g. after the MCU was reset"""
+        self._last_data = [None] * 32
+
+    def slot_statistics(self):
+        """Number of reads and data changes of the slots that have been read, the rest of the reads were skipped"""
+        return {slot: {'reads': reads, 'changes': self._changes[slot], 'change_rate': self._changes[slot] / reads}
+                for slot, reads in enumerate(self._reads) if reads}
+
     def _enable_slot(self, slot):
         print('McuStatusUpdater: enable slot {}'.format(slot))
         self._robot.status_updater_control(slot, True)
@@ -38,34 +80,79 @@ class McuStatusUpdater:
         print('McuStatusUpdater: disable slot {}'.format(slot))
         self._robot.status_updater_control(slot, False)
 
-    def set_slot(self, slot: int, cb):
+    def set_slot(self, slot: int, cb, slot_format: struct.Struct = None):
+        """Enable a slot and register its handler, or disable it if cb is not callable
+
+        Slots with a fixed layout can be registered with a compiled slot_format: their data is unpacked in place from
+        the response and the fields are passed to cb as arguments. Otherwise cb receives the data of the slot."""
         assert slot < len(self._handlers)
 
         if callable(cb):
             if not self._is_enabled[slot]:
                 self._is_enabled[slot] = True
                 self._handlers[slot] = cb
+                self._formats[slot] = slot_format
+                self._last_data[slot] = None
                 self._enable_slot(slot)
         else:
             if self._is_enabled[slot]:
                 self._is_enabled[slot] = False
                 self._handlers[slot] = lambda x: None
+                self._formats[slot] = None
+                self._last_data[slot] = None
                 self._disable_slot(slot)
 
     def read(self):
+        """Read the enabled slots and pass their data to the handlers
+
+        Returns False if there are enabled slots but the MCU did not send any data, which means it has been reset"""
+        # lets the handlers tell if the data already reflects the queued setpoints
+        self._robot.setpoints.mark_status_read()
         data = self._robot.status_updater_read()
+        if not data:
+            return not any(self._is_enabled)
+
+        handlers = self._handlers
+        formats = self._formats
+        last_data = self._last_data
+        reads = self._reads
+        changes = self._changes
+        length = len(data)
 
         idx = 0
-        while idx < len(data):
+        while idx < length:
             slot = data[idx]
             slot_length = data[idx + 1]
 
             data_start = idx + 2
-            data_end = idx + 2 + slot_length
+            data_end = data_start + slot_length
+            idx = data_end
 
-            if data_end <= len(data):
-                self._handlers[slot](data[data_start:data_end])
-            else:
+            if data_end > length:
                 print('McuStatusUpdater: invalid slot length')
+                continue
 
-            idx = data_end
+            reads[slot] += 1
+
+            # compared in place, the data of a slot is only copied if it changed
+            last = last_data[slot]
+            if last is not None and len(last) == slot_length and data.startswith(last, data_start):
+                continue
+
+            slot_format = formats[slot]
+            if slot_format is not None and slot_format.size != slot_length:
+                print('McuStatusUpdater: unexpected length {} for slot {}'.format(slot_length, slot))
+                continue
+
+            # stored before the handler runs, so that the handler can invalidate its own slot
+            slot_data = data[data_start:data_end]
+            last_data[slot] = slot_data
+            changes[slot] += 1
+
+            if slot_format is None:
+                handlers[slot](slot_data)
+            else:
+                handlers[slot](*slot_format.unpack_from(data, data_start))
+
+        self._updated_callback()
+        return True
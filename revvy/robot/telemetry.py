@@ -0,0 +1,280 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Recent history of the status data
+
+Every buffer holds the last `capacity` samples of a status slot, timestamped with the time of the status read in
+seconds since the robot was started (the time base of RobotInterface.time()). The buffers are change-driven: a
+sample is recorded when the data of the slot changes, not on every status read, so a value is valid until the
+timestamp of the next sample. last(n) returns the last n changes, and the window statistics weight every value by
+the time it was held.
+
+Each column is stored twice, one copy after the other, and every sample is written to both copies. This way the last
+n samples are always at consecutive positions, and the queries return memoryview slices of the storage instead of
+copies. Views are overwritten as new samples arrive: they are consistent when returned, but should be copied (e.g.
+with list()) if they are kept for longer than a status update or two. numpy.asarray() also accepts them without
+copying.
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class TelemetryWindow:
+    """A range of samples of a TelemetryBuffer, covering the time from start to end
+
+    A motor that holds its speed for 2 seconds, then changes it for a single status update:
+
+    >>> now = 2.02
+    >>> buffer = TelemetryBuffer((('speed', 'f'),), capacity=4, clock=lambda: now)
+    >>> buffer.append(0.0, 10)
+    >>> buffer.append(2.0, 100)
+    >>> window = buffer.last()
+    >>> list(window['speed']), round(window.mean('speed'), 2), window.min('speed'), window.max('speed')
+    ([10.0, 100.0], 10.89, 10.0, 100.0)
+    >>> round(buffer.since(1.0).mean('speed'), 2)
+    11.76
+    >>> buffer.last(0).mean('speed') is None
+    True
+    """
+
+    __slots__ = ('_timestamps', '_columns', '_start', '_end')
+
+    def __init__(self, timestamps, columns, start, end):
+        self._timestamps = timestamps
+        self._columns = columns
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        """The time up to which the last value is known to be valid"""
+        return self._end
+
+    def __getitem__(self, channel):
+        return self._columns[channel]
+
+    def mean(self, channel):
+        """Time-weighted mean, every value counts for the time it was held within the window"""
+        values = self._columns[channel]
+        count = len(values)
+        if count == 0:
+            return None
+
+        duration = self._end - self._start
+        if duration <= 0:
+            return sum(values) / count
+
+        timestamps = self._timestamps
+        total = 0.0
+        for i in range(count):
+            held_from = max(timestamps[i], self._start)
+            held_until = timestamps[i + 1] if i + 1 < count else self._end
+            total += values[i] * (held_until - held_from)
+
+        return total / duration
+
+    def min(self, channel):
+        values = self._columns[channel]
+        return min(values) if values else None
+
+    def max(self, channel):
+        values = self._columns[channel]
+        return max(values) if values else None
+
+
+class TelemetryBuffer:
+    """Fixed capacity ring buffer of timestamped samples
+
+    channels is a sequence of (name, array typecode) pairs, append() takes the values in the same order. clock
+    returns the time up to which the last sample is known to be valid (the time of the last status read), without a
+    clock the windows end at the last sample.
+
+    >>> buffer = TelemetryBuffer((('position', 'l'), ('speed', 'f')), capacity=3)
+    >>> len(buffer), buffer.latest
+    (0, None)
+    >>> for i in range(5):
+    ...     buffer.append(float(i), 10 * i, 0.5 * i)
+    >>> len(buffer), buffer.written, buffer.latest
+    (3, 5, (4.0, 40, 2.0))
+    >>> list(buffer.last()['position'])
+    [20, 30, 40]
+    >>> list(buffer.since(3.5).timestamps)  # the sample that was valid at 3.5 is included
+    [3.0, 4.0]
+    >>> list(buffer.since(10).timestamps)
+    [4.0]
+    """
+
+    def __init__(self, channels, capacity=256, clock=None):
+        self._capacity = capacity
+        self._clock = clock
+        self._names = tuple(name for name, _ in channels)
+        self._typecodes = tuple(typecode for _, typecode in channels)
+        self._timestamps = array('d', [0.0]) * (2 * capacity)
+        self._columns = [array(typecode, [0]) * (2 * capacity) for _, typecode in channels]
+        self._written = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def channels(self):
+        return self._names
+
+    @property
+    def typecodes(self):
+        return self._typecodes
+
+    @property
+    def written(self):
+        """Number of samples appended since the buffer was created or cleared"""
+        return self._written
+
+    def __len__(self):
+        return min(self._written, self._capacity)
+
+    def clear(self):
+        self._written = 0
+
+    def append(self, timestamp, *values):
+        i = self._written % self._capacity
+        j = i + self._capacity
+        self._timestamps[i] = self._timestamps[j] = timestamp
+        for column, value in zip(self._columns, values):
+            column[i] = column[j] = value
+
+        self._written += 1
+
+    @property
+    def latest(self):
+        """The last (timestamp, *values) tuple, or None if the buffer is empty"""
+        written = self._written
+        if written == 0:
+            return None
+
+        idx = (written - 1) % self._capacity
+        return (self._timestamps[idx], *(column[idx] for column in self._columns))
+
+    def _window(self, written, n, start_time=None):
+        end = (written - 1) % self._capacity + self._capacity + 1
+        start = end - n
+        columns = {name: memoryview(column)[start:end] for name, column in zip(self._names, self._columns)}
+        timestamps = memoryview(self._timestamps)[start:end]
+
+        if n == 0:
+            return TelemetryWindow(timestamps, columns, 0.0, 0.0)
+
+        start_time = timestamps[0] if start_time is None else max(start_time, timestamps[0])
+        end_time = timestamps[-1]
+        if self._clock is not None:
+            end_time = max(end_time, self._clock())
+        return TelemetryWindow(timestamps, columns, start_time, end_time)
+
+    def last(self, n=None):
+        """The last n samples, or all of them if n is None"""
+        written = self._written
+        available = min(written, self._capacity)
+        n = available if n is None else max(0, min(n, available))
+        return self._window(written, n)
+
+    def since(self, timestamp):
+        """The samples that were valid at or after the given time"""
+        written = self._written
+        everything = self._window(written, min(written, self._capacity))
+        first = max(0, bisect_right(everything.timestamps, timestamp) - 1)
+        return self._window(written, len(everything) - first, timestamp)
+
+
+class RobotTelemetry:
+    """History of every status slot of the robot, filled by the status update thread"""
+
+    motor_channels = (('position', 'i'), ('speed', 'f'), ('power', 'b'))
+    sensor_channels = (('value', 'd'),)
+    vector_channels = (('x', 'f'), ('y', 'f'), ('z', 'f'))
+    yaw_channels = (('absolute', 'i'), ('relative', 'i'))
+    battery_channels = (('main', 'B'), ('motor', 'B'))
+
+    def __init__(self, motor_ports, sensor_ports, capacity=256):
+        # the data of every slot is valid until the last status read, even if it did not change
+        def clock():
+            return self.timestamp
+
+        self.motors = {port: TelemetryBuffer(self.motor_channels, capacity, clock) for port in motor_ports}
+        self.sensors = {port: TelemetryBuffer(self.sensor_channels, capacity, clock) for port in sensor_ports}
+        self.acceleration = TelemetryBuffer(self.vector_channels, capacity, clock)
+        self.rotation = TelemetryBuffer(self.vector_channels, capacity, clock)
+        self.yaw = TelemetryBuffer(self.yaw_channels, capacity, clock)
+        self.battery = TelemetryBuffer(self.battery_channels, capacity, clock)
+
+        # time of the status read that is being processed
+        self.timestamp = 0.0
+
+        histories = [('motor{}'.format(port), history) for port, history in self.motors.items()]
+        histories += [('sensor{}'.format(port), history) for port, history in self.sensors.items()]
+        histories += [('acceleration', self.acceleration), ('rotation', self.rotation), ('yaw', self.yaw),
+                      ('battery', self.battery)]
+
+        # the latest value of every channel, in the order of self.columns
+        self._columns = [('timestamp', 'd')]
+        self._offsets = {}
+        for prefix, history in histories:
+            self._offsets[history] = len(self._columns)
+            self._columns += [('{}.{}'.format(prefix, name), typecode)
+                              for name, typecode in zip(history.channels, history.typecodes)]
+        self._current = [0] * len(self._columns)
+
+    @property
+    def columns(self):
+        """Name and typecode of the fields of the snapshot() records"""
+        return tuple(self._columns)
+
+    def snapshot(self):
+        """The latest value of every channel as a flat record, the first field is the timestamp
+
+        >>> telemetry = RobotTelemetry([1], [])
+        >>> telemetry.columns[0:3]
+        (('timestamp', 'd'), ('motor1.position', 'i'), ('motor1.speed', 'f'))
+        >>> telemetry.recorder(telemetry.yaw, lambda: None, lambda: (90, 45))()
+        >>> telemetry.snapshot()[-4:]
+        (90, 45, 0, 0)
+        """
+        current = self._current
+        current[0] = self.timestamp
+        return tuple(current)
+
+    def recorder(self, history: TelemetryBuffer, update, sample):
+        """Wrap a status slot callback so that it also records the values returned by sample()
+
+        Nothing is recorded if sample() returns None. The values are also kept for snapshot().
+
+        >>> telemetry = RobotTelemetry([1], [])
+        >>> values = []
+        >>> callback = telemetry.recorder(telemetry.motors[1], values.append, lambda: (values[-1], 0, 0))
+        >>> telemetry.timestamp = 1.5
+        >>> callback(42)
+        >>> telemetry.motors[1].latest
+        (1.5, 42, 0.0, 0)
+        """
+        current = self._current
+        start = self._offsets[history]
+        end = start + len(history.channels)
+
+        def _update(*args):
+            update(*args)
+            values = sample()
+            if values is not None:
+                history.append(self.timestamp, *values)
+                current[start:end] = values
+
+        return _update
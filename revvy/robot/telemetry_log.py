@@ -0,0 +1,244 @@
+# SPDX-License-Identifier: GPL-3.0-only
+
+"""Binary log of the status data for post-run analysis
+
+The status thread hands fixed-layout records (tuples) to TelemetryLog.append(), which never blocks: records are put
+into a bounded queue and counted as dropped if the queue is full. A writer thread stores them in segment files.
+
+A segment is a memory-mapped file of a fixed size with a columnar layout: a header, the column descriptors, then the
+values of every column one after the other, each column having room for the same number of records. The header
+holds the number of records written, which is updated after every batch, so a segment can be read while it is being
+written. A new segment is started when the current one is full and every time the writer is started, the oldest
+segments are deleted above max_segments.
+
+Values are stored in the native byte order of the writer, which is recorded in the header.
+
+>>> import tempfile
+>>> log = TelemetryLog(tempfile.mkdtemp(), queue_size=4)
+>>> log.open_segment((('timestamp', 'd'), ('position', 'i')))
+>>> for i in range(6):
+...     log.append((0.5 * i, 10 * i))
+>>> log.dropped
+2
+>>> log.write_pending(timeout=0)
+4
+>>> log.close_segment()
+>>> segment = read_segment(list_segments(log.directory)[0], use_numpy=False)
+>>> list(segment['timestamp']), list(segment['position'])
+([0.0, 0.5, 1.0, 1.5], [0, 10, 20, 30])
+"""
+
+import mmap
+import os
+import queue
+import struct
+import sys
+from array import array
+
+from revvy.thread_wrapper import ThreadWrapper, ThreadContext
+
+_magic = b'RVTL'
+_version = 1
+_header = struct.Struct('<4sHcxLLH')  # magic, version, byte order, capacity, record count, column count
+_column = struct.Struct('<24sc3xL')  # name, typecode, data offset
+_alignment = 8
+
+_byte_order = b'<' if sys.byteorder == 'little' else b'>'
+
+
+def _align(offset):
+    return (offset + _alignment - 1) // _alignment * _alignment
+
+
+def list_segments(directory):
+    """Paths of the segments in the directory, oldest first"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.startswith('telemetry-') and
+                       name.endswith('.bin'))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+
+def _read_layout(data):
+    (magic, version, byte_order, capacity, count, column_count) = _header.unpack_from(data)
+    if magic != _magic or version != _version:
+        raise ValueError('not a telemetry segment')
+
+    columns = []
+    for i in range(column_count):
+        (name, typecode, offset) = _column.unpack_from(data, _header.size + i * _column.size)
+        columns.append((name.rstrip(b'\0').decode(), typecode.decode(), offset))
+
+    return byte_order, capacity, count, columns
+
+
+def read_segment(path, use_numpy=True):
+    """Load the records of a segment as a dict of columns
+
+    The columns are numpy arrays if numpy is available and use_numpy is True, array.array objects otherwise."""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    (byte_order, capacity, count, columns) = _read_layout(data)
+    count = min(count, capacity)
+
+    numpy = None
+    if use_numpy:
+        try:
+            import numpy
+        except ImportError:
+            pass
+
+    result = {}
+    for name, typecode, offset in columns:
+        size = struct.calcsize(typecode)
+        if numpy is not None:
+            dtype = numpy.dtype(typecode).newbyteorder(byte_order.decode())
+            result[name] = numpy.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        else:
+            column = array(typecode)
+            column.frombytes(data[offset:offset + count * size])
+            if byte_order != _byte_order:
+                column.byteswap()
+            result[name] = column
+
+    return result
+
+
+class TelemetryLog:
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, max_segments=8, queue_size=256):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._max_segments = max_segments
+        self._queue = queue.Queue(queue_size)
+        self._dropped = 0
+        self._written = 0
+
+        self._columns = None
+        self._file = None
+        self._map = None
+        self._views = []
+        self._capacity = 0
+        self._count = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def dropped(self):
+        """Number of records that were discarded because the writer could not keep up"""
+        return self._dropped
+
+    @property
+    def written(self):
+        return self._written
+
+    def append(self, record):
+        """Queue a record for writing, never blocks"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+
+    def _next_segment_path(self):
+        segments = list_segments(self._directory)
+        for path in segments[:max(0, len(segments) - self._max_segments + 1)]:
+            os.remove(path)
+
+        number = int(os.path.basename(segments[-1])[10:-4]) + 1 if segments else 0
+        return os.path.join(self._directory, 'telemetry-{:06d}.bin'.format(number))
+
+    def open_segment(self, columns):
+        """Start a new segment, columns is a sequence of (name, typecode) pairs in the order of the record fields"""
+        self.close_segment()
+        self._columns = tuple(columns)
+
+        record_size = sum(struct.calcsize(typecode) for _, typecode in self._columns)
+        data_start = _align(_header.size + len(self._columns) * _column.size)
+        # leave room for the alignment of every column
+        capacity = (self._segment_size - data_start - len(self._columns) * _alignment) // record_size
+        if capacity <= 0:
+            raise ValueError('segment_size is too small for a record')
+
+        offsets = []
+        offset = data_start
+        for _, typecode in self._columns:
+            offsets.append(offset)
+            offset = _align(offset + capacity * struct.calcsize(typecode))
+
+        self._file = open(self._next_segment_path(), 'w+b')
+        self._file.truncate(offset)
+        self._map = mmap.mmap(self._file.fileno(), offset)
+        self._capacity = capacity
+        self._count = 0
+
+        for i, ((name, typecode), column_offset) in enumerate(zip(self._columns, offsets)):
+            _column.pack_into(self._map, _header.size + i * _column.size,
+                              name.encode(), typecode.encode(), column_offset)
+            end = column_offset + capacity * struct.calcsize(typecode)
+            self._views.append(memoryview(self._map)[column_offset:end].cast(typecode))
+
+        self._write_header()
+
+    def _write_header(self):
+        _header.pack_into(self._map, 0, _magic, _version, _byte_order, self._capacity, self._count, len(self._columns))
+
+    def close_segment(self):
+        if self._map is None:
+            return
+
+        self._write_header()
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self._map.close()
+        self._file.close()
+        self._map = None
+        self._file = None
+
+    def write_pending(self, timeout):
+        """Wait up to timeout seconds for records, then write everything that is queued, return the record count"""
+        try:
+            record = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+        except queue.Empty:
+            return 0
+
+        records = [record]
+        try:
+            while True:
+                records.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        for record in records:
+            if self._count == self._capacity:
+                self.open_segment(self._columns)
+
+            idx = self._count
+            for view, value in zip(self._views, record):
+                view[idx] = value
+            self._count += 1
+
+        self._written += len(records)
+        self._write_header()
+        return len(records)
+
+
+def create_telemetry_writer_thread(log: TelemetryLog, columns):
+    """A thread that writes the queued records into a new segment"""
+
+    def _write(ctx: ThreadContext):
+        log.open_segment(columns)
+        try:
+            while not ctx.stop_requested:
+                log.write_pending(timeout=0.1)
+        finally:
+            log.write_pending(timeout=0)
+            log.close_segment()
+            print('TelemetryLog: {} records written, {} dropped'.format(log.written, log.dropped))
+
+    return ThreadWrapper(_write, "TelemetryWriterThread")
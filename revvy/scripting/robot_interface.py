@@ -51,15 +51,20 @@ class Wrapper:
 class SensorPortWrapper(Wrapper):
     """Wrapper class to expose sensor ports to user scripts"""
 
-    def __init__(self, script, sensor: PortInstance, resource):
+    def __init__(self, script, sensor: PortInstance, resource, status_rate=None):
         super().__init__(script, resource)
         self._sensor = sensor
+        self._status_rate = status_rate
 
     def configure(self, config_name):
         self.using_resource(lambda: self._sensor.configure(config_name))
 
     def read(self):
         """Return the last converted value"""
+        if self._status_rate is not None:
+            # scripts that read sensors are likely to react to them, keep the data fresh
+            self._status_rate.request_data()
+
         start = time.time()
         while not self._sensor.has_data:
             self.check_terminated()
@@ -382,7 +387,8 @@ class RobotInterface:
             return 'sensor_{}'.format(port.id)
 
         motor_wrappers = [MotorPortWrapper(script, port, resources[motor_name(port)]) for port in robot.motors]
-        sensor_wrappers = [SensorPortWrapper(script, port, resources[sensor_name(port)]) for port in robot.sensors]
+        sensor_wrappers = [SensorPortWrapper(script, port, resources[sensor_name(port)], robot.status_rate)
+                           for port in robot.sensors]
         self._motors = PortCollection(motor_wrappers)
         self._sensors = PortCollection(sensor_wrappers)
         self._motors.aliases.update(config.motors.names)
@@ -400,6 +406,7 @@ class RobotInterface:
         self.set_volume = set_volume
 
         self.imu = robot.imu
+        self.telemetry = robot.telemetry
 
     def stop_all_motors(self, action):
         for motor in self._motors:
@@ -147,24 +147,31 @@ class ThreadContext:
         self._thread.on_stop_requested(callback)
 
 
-def periodic(fn, period, name="PeriodicThread"):
+def periodic(fn, period, name="PeriodicThread", wakeup: Event = None):
     """
     Call fn periodically
 
     :param fn: the function to run
-    :param period: period time in seconds
+    :param period: period time in seconds, or a function that returns the time until the next call
     :param name: optional name to prefix the thread log messages
+    :param wakeup: optional event, setting it makes the next call without waiting for the end of the period
     :return: the created thread object
     """
+    next_period = period if callable(period) else lambda: period
+
     def _call_periodically(ctx: ThreadContext):
         _next_call = time.time()
         while not ctx.stop_requested:
             fn()
 
-            _next_call += period
+            _next_call += next_period()
             diff = _next_call - time.time()
             if diff > 0:
-                time.sleep(diff)
+                if wakeup is None:
+                    time.sleep(diff)
+                elif wakeup.wait(diff):
+                    wakeup.clear()
+                    _next_call = time.time()
             else:
                 # period was missed, let's restart
                 _next_call = time.time()
@@ -3,12 +3,18 @@
 import enum
 import os
 import signal
+import struct
 import traceback
 from collections import namedtuple
+from threading import Lock
 
 from revvy.file_storage import StorageInterface, StorageError
 from revvy.hardware_dependent.sound import setup_sound_v2, play_sound_v2, reset_volume
+from revvy.mcu.capability_cache import CapabilityCache, read_capabilities
+from revvy.mcu.error_memory import ErrorMemoryLog, create_error_memory_sync_thread
 from revvy.mcu.rrrc_control import RevvyControl, BatteryStatus, Version
+from revvy.mcu.setpoint_outbox import create_setpoint_outbox_thread
+from revvy.retry_policy import RetryPolicy, ExponentialBackoff, SampledErrorReporter
 from revvy.robot.drivetrain import DifferentialDrivetrain
 from revvy.robot.imu import IMU
 from revvy.robot.remote_controller import RemoteController, RemoteControllerScheduler, create_remote_controller_thread
@@ -18,12 +24,15 @@ from revvy.robot.ports.motor import create_motor_port_handler
 from revvy.robot.ports.sensor import create_sensor_port_handler
 from revvy.robot.sound import Sound
 from revvy.robot.status import RobotStatus, RemoteControllerStatus, RobotStatusIndicator
+from revvy.robot.status_rate import StatusRateScheduler
 from revvy.robot.status_updater import McuStatusUpdater, mcu_updater_slots
+from revvy.robot.telemetry import RobotTelemetry
+from revvy.robot.telemetry_log import TelemetryLog, create_telemetry_writer_thread
 from revvy.robot_config import RobotConfig
 from revvy.scripting.resource import Resource
 from revvy.scripting.robot_interface import MotorConstants
 from revvy.scripting.runtime import ScriptManager
-from revvy.thread_wrapper import periodic
+from revvy.thread_wrapper import periodic, ThreadWrapper, ThreadContext
 
 from revvy.mcu.rrrc_transport import *
 
@@ -96,12 +105,48 @@ Sensors = {
 
 RobotVersion = namedtuple("RobotVersion", ['hw', 'fw', 'sw'])
 
+# main status, main percentage, motor status, motor percentage
+_battery_slot_format = struct.Struct('<BBBB')
+
+
+class StartupTimer:
+    """Collects the duration of the startup steps"""
+
+    def __init__(self):
+        self._start = time.monotonic()
+        self._last = self._start
+        self._steps = []
+
+    def step(self, name):
+        """Mark the end of a step that started at the end of the previous one"""
+        now = time.monotonic()
+        self._steps.append((name, now - self._last))
+        self._last = now
+
+    @property
+    def steps(self):
+        return list(self._steps)
+
+    @property
+    def total(self):
+        return self._last - self._start
+
+    def report(self):
+        steps = ', '.join('{} {:.1f}ms'.format(name, 1000 * duration) for name, duration in self._steps)
+        print('Startup: {} (total: {:.1f}ms)'.format(steps, 1000 * self.total))
+
 
 class Robot:
-    def __init__(self, interface: RevvyControl, sound_paths, sw_version):
+    # consecutive empty status reads before the MCU is considered to have been reset
+    reset_confirmation_reads = 3
+    # [seconds] minimum time between two configuration restores
+    restore_interval = 1.0
+
+    def __init__(self, interface: RevvyControl, sound_paths, sw_version, capability_cache: CapabilityCache = None):
         self._interface = interface
 
         self._start_time = time.time()
+        self._startup_timer = StartupTimer()
 
         # read versions
         hw = interface.get_hardware_version()
@@ -111,36 +156,134 @@ class Robot:
         print('Hardware: {}\nFirmware: {}\nFramework: {}'.format(hw, fw, sw))
 
         self._version = RobotVersion(hw, fw, sw)
+        self._startup_timer.step('versions')
+
+        # the capabilities only change with the firmware, the versions that were just read validate the stored ones
+        self._capability_cache = capability_cache
+        capabilities = capability_cache.load(hw, fw) if capability_cache is not None else None
+        self._capabilities_cached = capabilities is not None
+        if capabilities is None:
+            capabilities = read_capabilities(interface)
+            if capability_cache is not None:
+                capability_cache.store(hw, fw, capabilities)
+            self._startup_timer.step('capabilities')
+        else:
+            self._startup_timer.step('capabilities (cached)')
+        self._capabilities = capabilities
+        self._port_layout_stale = False
 
-        self._ring_led = RingLed(interface)
+        self._ring_led = RingLed(interface, capabilities.ring_led_amount)
         self._sound = Sound(setup_sound_v2, play_sound_v2, sound_paths or {})
+        self._startup_timer.step('sound')
 
         self._status = RobotStatusIndicator(interface)
         self._status_updater = McuStatusUpdater(interface)
+        self._last_status_read = time.monotonic()
+        self._empty_status_reads = 0
+        self._last_restore = None
         self._battery = BatteryStatus(0, 0, 0)
 
         self._imu = IMU()
 
         def _motor_config_changed(motor: PortInstance, config_name):
-            callback = None if config_name == 'NotConfigured' else motor.update_status
+            history = self._telemetry.motors[motor.id]
+            history.clear()
+            if config_name == 'NotConfigured':
+                callback = None
+            else:
+                callback = self._telemetry.recorder(history, motor.update_status,
+                                                    lambda: (motor.position, motor.speed, motor.power))
             self._status_updater.set_slot(mcu_updater_slots["motors"][motor.id], callback)
 
         def _sensor_config_changed(sensor: PortInstance, config_name):
-            callback = None if config_name == 'NotConfigured' else sensor.update_status
+            history = self._telemetry.sensors[sensor.id]
+            history.clear()
+            if config_name == 'NotConfigured':
+                callback = None
+            else:
+                callback = self._telemetry.recorder(history, sensor.update_status,
+                                                    lambda: None if sensor.value is None else (sensor.value,))
             self._status_updater.set_slot(mcu_updater_slots["sensors"][sensor.id], callback)
 
         print("!"*20)
         print(Motors)
 
-        self._motor_ports = create_motor_port_handler(interface, Motors)
+        def _motor_status_invalidated(motor: PortInstance):
+            self._status_updater.invalidate_slot(mcu_updater_slots["motors"][motor.id])
+
+        self._motor_ports = create_motor_port_handler(interface, Motors,
+                                                      capabilities.motor_port_amount, capabilities.motor_port_types)
         for port in self._motor_ports:
             port.on_config_changed(_motor_config_changed)
+            port.on_status_invalidated(_motor_status_invalidated)
 
-        self._sensor_ports = create_sensor_port_handler(interface, Sensors)
+        self._sensor_ports = create_sensor_port_handler(interface, Sensors,
+                                                        capabilities.sensor_port_amount, capabilities.sensor_port_types)
         for port in self._sensor_ports:
             port.on_config_changed(_sensor_config_changed)
 
+        self._telemetry = RobotTelemetry([port.id for port in self._motor_ports],
+                                         [port.id for port in self._sensor_ports])
+
         self._drivetrain = DifferentialDrivetrain(interface, self._motor_ports.port_count)
+        self._startup_timer.step('ports')
+
+        # the drivetrain motors are among the motor ports
+        self._status_rate = StatusRateScheduler()
+        self._status_rate.add_activity(lambda: any(motor.is_moving for motor in self._motor_ports))
+        interface.setpoints.on_issued(self._status_rate.request_update)
+
+    @property
+    def status_updater(self):
+        return self._status_updater
+
+    @property
+    def status_rate(self):
+        return self._status_rate
+
+    @property
+    def telemetry(self):
+        return self._telemetry
+
+    @property
+    def startup_timer(self):
+        return self._startup_timer
+
+    @property
+    def capabilities_cached(self):
+        """True if the MCU capabilities were loaded from the cache instead of being queried"""
+        return self._capabilities_cached
+
+    @property
+    def port_layout_stale(self):
+        """True if the ports were set up with capabilities that turned out to be outdated"""
+        return self._port_layout_stale
+
+    def refresh_capabilities(self):
+        """Query the capabilities, update the cache and return True if they differ from the ones in use
+
+        The new port types are used from the next reset(), a different number of ports needs a restart."""
+        capabilities = read_capabilities(self._interface)
+        if capabilities == self._capabilities:
+            return False
+
+        print('Robot: MCU capabilities differ from the cached ones')
+        if self._capability_cache is not None:
+            self._capability_cache.store(self._version.hw, self._version.fw, capabilities)
+        self._capabilities = capabilities
+        self._port_layout_stale = True
+        return True
+
+    def _update_port_layout(self):
+        capabilities = self._capabilities
+        self._motor_ports.update_types(capabilities.motor_port_types)
+        self._sensor_ports.update_types(capabilities.sensor_port_types)
+
+        if self._motor_ports.port_count != capabilities.motor_port_amount or \
+                self._sensor_ports.port_count != capabilities.sensor_port_amount:
+            print('Robot: the number of ports changed, restart to use every port')
+        else:
+            self._port_layout_stale = False
 
     @property
     def start_time(self):
@@ -183,29 +326,71 @@ class Robot:
         return self._sound
 
     def update_status(self):
-        self._status_updater.read()
+        self._telemetry.timestamp = time.time() - self._start_time
+        if self._status_updater.read():
+            self._last_status_read = time.monotonic()
+            self._empty_status_reads = 0
+            return
+
+        # a reset MCU does not send data for the slots that were enabled, but a single empty read is not proof of it
+        self._empty_status_reads += 1
+        if self._empty_status_reads < self.reset_confirmation_reads:
+            return
+
+        if self._last_restore is not None and time.monotonic() - self._last_restore < self.restore_interval:
+            return
+
+        self._restore_mcu_configuration()
+
+    def _restore_mcu_configuration(self):
+        """Bring a freshly reset MCU back to the last configuration without going through the full configure path"""
+        print('Robot: MCU reset detected ({} empty status reads), restoring configuration'.format(
+            self._empty_status_reads))
+        self._interface.state_cache.invalidate()
+        self._interface.setpoints.clear()
+
+        # the data of a slot may happen to match the last one read before the reset
+        self._status_updater.invalidate_all()
+
+        responses = self._interface.config_journal.replay()
+        failed = sum(1 for r in responses if r.error is not None or r.status != ResponseHeader.Status_Ok)
+        print('Robot: {} configuration commands replayed in {:.1f}ms, {} failed, {:.1f}ms since last status'.format(
+            len(responses), 1000 * self._interface.config_journal.last_replay_time, failed,
+            1000 * (time.monotonic() - self._last_status_read)))
+
+        self._last_status_read = time.monotonic()
+        self._last_restore = self._last_status_read
+        self._empty_status_reads = 0
 
     def reset(self):
+        # setpoints that were not sent yet belong to the old configuration
+        self._interface.setpoints.clear()
+
         self._ring_led.set_scenario(RingLed.BreathingGreen)
         self._status_updater.reset()
 
-        def _process_battery_slot(data):
-            assert len(data) == 4
-            main_status = data[0]
-            main_percentage = data[1]
-            # motor_status = data[2]
-            motor_percentage = data[3]
-
+        def _process_battery_slot(main_status, main_percentage, motor_status, motor_percentage):
             self._battery = BatteryStatus(chargerStatus=main_status, main=main_percentage, motor=motor_percentage)
 
-        self._status_updater.set_slot(mcu_updater_slots["battery"], _process_battery_slot)
-        self._status_updater.set_slot(mcu_updater_slots["axl"], self._imu.update_axl_data)
-        self._status_updater.set_slot(mcu_updater_slots["gyro"], self._imu.update_gyro_data)
-        self._status_updater.set_slot(mcu_updater_slots["yaw"], self._imu.update_yaw_angles)
+        telemetry = self._telemetry
+        imu = self._imu
+        battery_slot = telemetry.recorder(telemetry.battery, _process_battery_slot,
+                                          lambda: (self._battery.main, self._battery.motor))
+        axl_slot = telemetry.recorder(telemetry.acceleration, imu.update_axl_data, lambda: imu.acceleration)
+        gyro_slot = telemetry.recorder(telemetry.rotation, imu.update_gyro_data, lambda: imu.rotation)
+        yaw_slot = telemetry.recorder(telemetry.yaw, imu.update_yaw_angles,
+                                      lambda: (imu.yaw_angle, imu.relative_yaw_angle))
+
+        self._status_updater.set_slot(mcu_updater_slots["battery"], battery_slot, _battery_slot_format)
+        self._status_updater.set_slot(mcu_updater_slots["axl"], axl_slot, IMU.vector_format)
+        self._status_updater.set_slot(mcu_updater_slots["gyro"], gyro_slot, IMU.vector_format)
+        self._status_updater.set_slot(mcu_updater_slots["yaw"], yaw_slot, IMU.yaw_format)
 
         self._drivetrain.reset()
         self._motor_ports.reset()
         self._sensor_ports.reset()
+        if self._port_layout_stale:
+            self._update_port_layout()
 
         self._status.robot_status = RobotStatus.NotConfigured
         self._status.update()
@@ -221,20 +406,40 @@ class RevvyStatusCode(enum.IntEnum):
 class RobotManager:
 
     # FIXME: revvy intentionally doesn't have a type hint at this moment because it breaks tests right now
-    def __init__(self, interface: RevvyControl, revvy, sound_paths, sw_version, default_config=None):
+    def __init__(self, interface: RevvyControl, revvy, sound_paths, sw_version, default_config=None,
+                 capability_cache: CapabilityCache = None, error_log: ErrorMemoryLog = None,
+                 telemetry_log: TelemetryLog = None):
         print("RobotManager: __init__()")
         self.needs_interrupting = True
 
         self._configuring = False
-        self._robot = Robot(interface, sound_paths, sw_version)
+        self._robot = Robot(interface, sound_paths, sw_version, capability_cache)
         self._interface = interface
         self._ble = revvy
         self._default_configuration = default_config or RobotConfig()
 
-        self._status_update_thread = periodic(self._update, 0.02, "RobotStatusUpdaterThread")
+        status_rate = self._robot.status_rate
+        status_rate.add_activity(lambda: self._robot.status.controller_status == RemoteControllerStatus.Controlled)
+        self._status_update_thread = periodic(self._update, status_rate.next_period, "RobotStatusUpdaterThread",
+                                              status_rate.wakeup_event)
+        self._setpoint_outbox_thread = create_setpoint_outbox_thread(interface.setpoints)
+        # the queries would hold up the status updates, so they get a thread of their own
+        self._capability_refresh_thread = ThreadWrapper(self._refresh_capabilities, "CapabilityRefreshThread")
+        self._error_memory_sync_thread = create_error_memory_sync_thread(error_log, interface) \
+            if error_log is not None else None
+
+        self._telemetry_writer_thread = None
+        if telemetry_log is not None:
+            telemetry = self._robot.telemetry
+            self._robot.status_updater.on_updated(lambda: telemetry_log.append(telemetry.snapshot()))
+            self._telemetry_writer_thread = create_telemetry_writer_thread(telemetry_log, telemetry.columns)
         self._background_fn_lock = Lock()
         self._background_fns = []
 
+        # the MCU may need a while to boot, or to come back after a reset: keep trying without flooding the log
+        self._ping_retry_policy = RetryPolicy(None, ExponentialBackoff(0.1, 0.5), retry_on=(IOError, OSError),
+                                              reporter=SampledErrorReporter('RobotManager: ping'))
+
         rc = RemoteController()
         rcs = RemoteControllerScheduler(rc)
         rcs.on_controller_detected(self._on_controller_detected)
@@ -265,7 +470,9 @@ class RobotManager:
     def _update(self):
         # noinspection PyBroadException
         try:
+            start = time.perf_counter()
             self._robot.update_status()
+            self._robot.status_rate.record_update(time.perf_counter() - start)
 
             self._ble['battery_service'].characteristic('main_battery').update_value(self._robot.battery.main)
             self._ble['battery_service'].characteristic('motor_battery').update_value(self._robot.battery.motor)
@@ -325,19 +532,42 @@ class RobotManager:
         if self._robot.status.robot_status == RobotStatus.StartingUp:
             print("Waiting for MCU")
             # TODO if we are getting stuck here (> ~3s), firmware is probably not valid
+            startup_timer = self._robot.startup_timer
             self._ping_robot()
+            startup_timer.step('ping')
 
             self._ble['device_information_service'].characteristic('hw_version').update(str(self._robot.version.hw))
             self._ble['device_information_service'].characteristic('fw_version').update(str(self._robot.version.fw))
             self._ble['device_information_service'].characteristic('sw_version').update(self._robot.version.sw)
 
             # start reader thread
+            if self._telemetry_writer_thread is not None:
+                self._telemetry_writer_thread.start()
             self._status_update_thread.start()
+            self._setpoint_outbox_thread.start()
+            startup_timer.step('threads')
 
             self._ble.start()
+            startup_timer.step('ble')
+            startup_timer.report()
+
+            if self._robot.capabilities_cached:
+                self._capability_refresh_thread.start()
+
+            if self._error_memory_sync_thread is not None:
+                self._error_memory_sync_thread.start()
             self._robot.status.robot_status = RobotStatus.NotConfigured
             self.configure(None, lambda: self.sound.play_tune('robot2'))
 
+    def _refresh_capabilities(self, ctx: ThreadContext):
+        if self._robot.refresh_capabilities() and not ctx.stop_requested:
+            # set the ports up again with the new port types
+            self.run_in_background(self._reapply_configuration)
+
+    def _reapply_configuration(self):
+        if self._robot.status.robot_status != RobotStatus.Stopped:
+            self._configure(None if self._config is self._default_configuration else self._config)
+
     def run_in_background(self, callback):
         if callable(callback):
             with self._background_fn_lock:
@@ -464,16 +694,17 @@ class RobotManager:
         self._remote_controller_thread.exit()
         self._ble.stop()
         self._scripts.reset()
+        self._setpoint_outbox_thread.exit()
+        self._capability_refresh_thread.exit()
         self._status_update_thread.exit()
+        if self._telemetry_writer_thread is not None:
+            self._telemetry_writer_thread.exit()
+        if self._error_memory_sync_thread is not None:
+            self._error_memory_sync_thread.exit()
 
     def _ping_robot(self):
-        retry_ping = True
-        while retry_ping:
-            retry_ping = False
-            try:
-                self._interface.ping()
-            except (BrokenPipeError, IOError, OSError):
-                retry_ping = True
-                time.sleep(0.1)
+        # the MCU may have been reset, the state it was last set to is not known
+        self._interface.state_cache.invalidate()
+        self._ping_retry_policy.run(self._interface.ping)
 
 